@@ -18,18 +18,44 @@ Assumes the following directory structure:
 └── <course n>/
     └── ...
 
+With --normalize, the whitespace left by the comment removal is also removed
+and the token savings are reported per submission. Optionally, the #include
+lines and the code generated by Qt (moc_*, ui_*, qrc_*) are dropped.
+
+With --summarize-ui, the Qt Designer .ui files are saved as compact summaries
+of their widget trees, which are included in the prompts like the code files.
+
 Usage:
-python clean_repositories.py <root>
+python anonymize_cpp_files.py <root> [--normalize] [--drop-includes] [--drop-generated] [--summarize-ui] [--report-file <file>]
 """
 
 import argparse
+import json
 import os
 import re
 import shutil
+import xml.etree.ElementTree as ElementTree
 
+from typing import Optional, TypedDict
+from cpp_normalizer import (
+    DEFAULT_INDENT_WIDTH,
+    NormalizationOptions,
+    is_qt_generated,
+    normalize_source,
+)
+from prompt_data import ENCODING, count_tokens
+from ui_summarizer import summarize_ui
 from utils import on_rm_error
 
 
+class TokenSavings(TypedDict):
+    course: str
+    project: str
+    student: str
+    tokens_before: int
+    tokens_after: int
+
+
 COMMENT_PATTERN = re.compile(
     r'//.*?$|/\*.*?\*/|\'(?:\\.|[^\\\'])*\'|"(?:\\.|[^\\"])*"',
     re.DOTALL | re.MULTILINE,
@@ -48,17 +74,124 @@ def remove_comments(text: str):
     return re.sub(COMMENT_PATTERN, replacer, text)
 
 
-def remove_comments_from_file(file_path: str, destination: str):
+def anonymize_source(
+    file_name: str,
+    source_code: str,
+    options: Optional[NormalizationOptions] = None,
+) -> tuple[Optional[str], int, int]:
+    """Returns the code without the comments, or None if it is generated by Qt
+    and dropped, and the token counts before and after the normalization, or
+    zeros without it"""
+    if options and options.drop_generated and is_qt_generated(file_name, source_code):
+        return None, count_tokens(remove_comments(source_code)), 0
+
+    source_code = remove_comments(source_code)
+    tokens_before = tokens_after = 0
+
+    if options:
+        tokens_before = count_tokens(source_code)
+        source_code = normalize_source(source_code, options)
+        tokens_after = count_tokens(source_code)
+
+    return source_code, tokens_before, tokens_after
+
+
+def remove_comments_from_file(
+    file_path: str,
+    destination: str,
+    options: Optional[NormalizationOptions] = None,
+) -> tuple[int, int]:
+    """Returns the token counts before and after the normalization, or zeros
+    without it"""
     with open(file_path, "r", encoding="ISO-8859-1") as file:
-        source_code = file.read()
+        source_code, tokens_before, tokens_after = anonymize_source(
+            os.path.basename(file_path), file.read(), options
+        )
+
+    if source_code is None:
+        return tokens_before, tokens_after
 
     with open(destination, "w", encoding="ISO-8859-1") as file:
-        file.write(remove_comments(source_code))
+        file.write(source_code)
+
+    return tokens_before, tokens_after
+
+
+def summarize_ui_file(file_path: str, destination: str):
+    try:
+        summary = summarize_ui(file_path)
+    except ElementTree.ParseError as e:
+        print(f"Skipping {file_path}: {e}")
+        return
+
+    with open(destination, "w", encoding=ENCODING) as file:
+        file.write(summary)
+
+
+def print_token_savings(token_savings: list[TokenSavings]):
+    for savings in token_savings:
+        saved = savings["tokens_before"] - savings["tokens_after"]
+        print(
+            f"{savings['course']}/{savings['project']}/{savings['student']}: "
+            f"{savings['tokens_before']} -> {savings['tokens_after']} tokens "
+            f"(-{saved / max(savings['tokens_before'], 1):.1%})"
+        )
 
+    tokens_before = sum(savings["tokens_before"] for savings in token_savings)
+    tokens_after = sum(savings["tokens_after"] for savings in token_savings)
+    print(
+        f"Total: {tokens_before} -> {tokens_after} tokens "
+        f"(-{(tokens_before - tokens_after) / max(tokens_before, 1):.1%})"
+    )
+
+
+def anonymize_student(
+    student_path: str,
+    options: Optional[NormalizationOptions] = None,
+    summarize_ui_files: bool = False,
+) -> tuple[int, int]:
+    """Anonymizes the src directory of the student to the anonymized directory
+    and returns the token counts before and after the normalization"""
+    src_path = os.path.join(student_path, "src")
+    destination = os.path.join(student_path, "anonymized")
+
+    if os.path.isdir(destination):
+        shutil.rmtree(destination, onexc=on_rm_error)  # type: ignore
+
+    os.mkdir(destination)
+    tokens_before = tokens_after = 0
+
+    for file in os.listdir(src_path):
+        if summarize_ui_files and file.endswith(".ui"):
+            summarize_ui_file(
+                os.path.join(src_path, file),
+                os.path.join(destination, file),
+            )
+            continue
+
+        if not file.endswith((".cpp", ".hh")):
+            continue
+
+        file_tokens_before, file_tokens_after = remove_comments_from_file(
+            os.path.join(src_path, file),
+            os.path.join(destination, file),
+            options,
+        )
+        tokens_before += file_tokens_before
+        tokens_after += file_tokens_after
+
+    return tokens_before, tokens_after
+
+
+def anonymize_files(
+    root_directory: str,
+    options: Optional[NormalizationOptions] = None,
+    summarize_ui_files: bool = False,
+) -> list[TokenSavings]:
+    token_savings: list[TokenSavings] = []
 
-def anonymize_files(root_directory: str):
     for course_dir in os.listdir(root_directory):
-        course_path = os.path.join(args.root, course_dir)
+        course_path = os.path.join(root_directory, course_dir)
 
         if os.path.isdir(course_path):
             projects_path = os.path.join(course_path, "student_repositories")
@@ -67,30 +200,59 @@ def anonymize_files(root_directory: str):
                 project_path = os.path.join(projects_path, project_dir)
 
                 for student_dir in os.listdir(project_path):
-                    student_path = os.path.join(project_path, student_dir)
-                    src_path = os.path.join(student_path, "src")
-                    destination = os.path.join(student_path, "anonymized")
-
-                    if os.path.isdir(destination):
-                        shutil.rmtree(destination, onexc=on_rm_error)  # type: ignore
-
-                    os.mkdir(destination)
-
-                    for file in os.listdir(src_path):
-                        if not file.endswith((".cpp", ".hh")):
-                            continue
+                    tokens_before, tokens_after = anonymize_student(
+                        os.path.join(project_path, student_dir),
+                        options,
+                        summarize_ui_files,
+                    )
 
-                        remove_comments_from_file(
-                            os.path.join(src_path, file),
-                            os.path.join(destination, file),
+                    if options:
+                        token_savings.append(
+                            {
+                                "course": course_dir,
+                                "project": project_dir,
+                                "student": student_dir,
+                                "tokens_before": tokens_before,
+                                "tokens_after": tokens_after,
+                            }
                         )
 
+    return token_savings
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     parser.add_argument("root")
+    parser.add_argument("--normalize", action="store_true")
+    parser.add_argument("--indent-width", type=int, default=DEFAULT_INDENT_WIDTH)
+    parser.add_argument("--drop-includes", action="store_true")
+    parser.add_argument("--drop-generated", action="store_true")
+    parser.add_argument("--summarize-ui", action="store_true")
+    parser.add_argument("--report-file")
 
     args = parser.parse_args()
 
-    anonymize_files(args.root)
+    if (args.drop_includes or args.drop_generated) and not args.normalize:
+        parser.error("--drop-includes and --drop-generated require --normalize")
+
+    token_savings = anonymize_files(
+        args.root,
+        (
+            NormalizationOptions(
+                indent_width=args.indent_width,
+                drop_includes=args.drop_includes,
+                drop_generated=args.drop_generated,
+            )
+            if args.normalize
+            else None
+        ),
+        args.summarize_ui,
+    )
+
+    if token_savings:
+        print_token_savings(token_savings)
+
+    if args.report_file:
+        with open(args.report_file, "w", encoding="utf-8") as file:
+            json.dump(token_savings, file, indent=2)
@@ -104,11 +104,15 @@ def delete_dir_or_file(path: str):
         os.remove(path)
 
 
+def is_deleted_directory(dir_name: str) -> bool:
+    return dir_name in (TO_BE_DELETED["exact"]) or dir_name.startswith(
+        TO_BE_DELETED["prefixes"]
+    )
+
+
 def safe_delete_directory(dir_name: str, filepath: str) -> bool:
     """Deletes the directory only if its name is not unknown"""
-    if dir_name in (TO_BE_DELETED["exact"]) or dir_name.startswith(
-        TO_BE_DELETED["prefixes"]
-    ):
+    if is_deleted_directory(dir_name):
         delete_dir_or_file(filepath)
         return True
     else:
@@ -2,6 +2,8 @@ import argparse
 import os
 import csv
 
+from results_store import RESULTS_STORE_FILENAME, connect, get_points_columns
+
 
 def get_points(rows: list[list[str]], index: int) -> tuple[str, ...]:
     return tuple(row[index] for row in rows)
@@ -33,11 +35,24 @@ def get_combined_scores(
     return combined_scores
 
 
+def get_combined_scores_from_store(results_dir: str) -> list[tuple[str, ...]]:
+    labels, ai_points, actual_points = get_points_columns(
+        connect(os.path.join(results_dir, RESULTS_STORE_FILENAME)),
+        "overall_solution",
+    )
+
+    for i, label in enumerate(labels):
+        print(f"{i + 1}.\t{label}")
+
+    return ai_points + [actual_points]
+
+
 def main():
     parser = argparse.ArgumentParser()
 
     parser.add_argument("results_dir")
     parser.add_argument("output_file")
+    parser.add_argument("--results-store", choices=("files", "sqlite"), default="files")
 
     args = parser.parse_args()
 
@@ -47,7 +62,9 @@ def main():
         newline="",
     ) as file:
         csv.writer(file).writerows(
-            get_combined_scores(args.results_dir, "overall_points_comparison.csv")
+            get_combined_scores_from_store(args.results_dir)
+            if args.results_store == "sqlite"
+            else get_combined_scores(args.results_dir, "overall_points_comparison.csv")
         )
 
 
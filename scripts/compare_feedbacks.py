@@ -1,82 +1,416 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import json
 import os
-from time import sleep
-from typing import Literal, TypedDict
+import re
+import sqlite3
+from math import sqrt
+from time import perf_counter, sleep
+from typing import Any, Callable, Literal, Optional, TypedDict
 from openai import OpenAI
+from openai.types import CompletionUsage
 from prompt_data import (
     TrainingData,
+    TrainingDataEntry,
     ENCODING,
-    SYSTEM_MESSAGE_CONTENT,
     get_training_data,
 )
-from prompt_data.openai import Role
-from submission_data import Points, get_points_from_feedback
+from prompt_data.openai import get_messages
+from run_fine_tuning import NON_RETRYABLE_ERRORS, read_run_manifest
+from results_store import (
+    RESULTS_STORE_FILENAME,
+    SKIPPED_POINTS,
+    GradingRow,
+    RequestRow,
+    connect,
+    create_run,
+    save_gradings,
+    save_requests,
+)
+from submission_data import Points, parse_feedback
 
 REQUEST_TIMEOUT_SECONDS = 60
+MAX_RETRIES = 10
+DEFAULT_CONCURRENCY = 8
+PERCENTILES = (50, 95, 99)
+# z-score of the 95% confidence interval of the mean points
+CONFIDENCE_Z = 1.96
+DEFAULT_MIN_ITERATIONS = 2
+DEFAULT_MAX_CI_HALF_WIDTH = 0.5
 
 
 class Feedback(TypedDict):
     message: str
     points: Points
+    structured: dict[str, Any]
+
+
+class Usage(TypedDict):
+    prompt_tokens: int
+    cached_tokens: int
+    completion_tokens: int
+
+
+class RequestTelemetry(TypedDict):
+    # Seconds from sending the request to the first content token. Only
+    # measured when streaming.
+    time_to_first_token: Optional[float]
+    latency: float
+    tokens_per_second: float
+    retries: int
 
 
 class AIGradingEntry(TypedDict):
+    model: str
     source_code_path: str
     user_prompt: str
     ai_feedback: Feedback
     actual_feedback: Feedback
+    usage: Usage
+    telemetry: RequestTelemetry
 
 
 AIGradingEntries = list[AIGradingEntry]
+# Called with the model, the iteration and its gradings in the submission order
+# of the training data, None for the submissions not graded in the iteration
+OnComplete = Callable[[str, int, list[Optional[AIGradingEntry]]], None]
 
 
-def send_prompt(api_key: str, model: str, user_prompt: str) -> str:
-    try:
-        return str(
-            OpenAI(api_key=api_key)
-            .chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": Role.System, "content": SYSTEM_MESSAGE_CONTENT},
-                    {"role": Role.User, "content": user_prompt},
-                ],
+def get_usage(usage: Optional[CompletionUsage]) -> Usage:
+    if not usage:
+        return {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+
+    details = usage.prompt_tokens_details
+
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "cached_tokens": (details.cached_tokens or 0) if details else 0,
+        "completion_tokens": usage.completion_tokens,
+    }
+
+
+def get_completion(
+    client: OpenAI,
+    model: str,
+    user_prompt: str,
+    stream: bool,
+) -> tuple[str, Optional[CompletionUsage], Optional[float]]:
+    """Returns the completion message, its usage and the time to the first
+    content token when streaming"""
+    messages = get_messages(user_prompt)
+
+    if not stream:
+        completion = client.chat.completions.create(
+            model=model, messages=messages  # type: ignore
+        )
+
+        return str(completion.choices[0].message.content), completion.usage, None
+
+    start = perf_counter()
+    time_to_first_token: Optional[float] = None
+    usage: Optional[CompletionUsage] = None
+    parts: list[str] = []
+
+    for chunk in client.chat.completions.create(
+        model=model,
+        messages=messages,  # type: ignore
+        stream=True,
+        stream_options={"include_usage": True},
+    ):
+        if chunk.usage:
+            usage = chunk.usage
+
+        if chunk.choices and chunk.choices[0].delta.content:
+            if time_to_first_token is None:
+                time_to_first_token = perf_counter() - start
+
+            parts.append(chunk.choices[0].delta.content)
+
+    return "".join(parts), usage, time_to_first_token
+
+
+def send_prompt(
+    client: OpenAI,
+    model: str,
+    user_prompt: str,
+    stream: bool = False,
+    retry_delay: float = REQUEST_TIMEOUT_SECONDS,
+    max_retries: int = MAX_RETRIES,
+) -> tuple[str, Usage, RequestTelemetry]:
+    """Sends the prompt, trying again after `retry_delay` seconds up to
+    `max_retries` times. Raises the last error when the retries run out or
+    the error is not retryable."""
+    retries = 0
+
+    while True:
+        start = perf_counter()
+
+        try:
+            message, usage, time_to_first_token = get_completion(
+                client, model, user_prompt, stream
             )
-            .choices[0]
-            .message.content
+        except Exception as e:
+            if isinstance(e, NON_RETRYABLE_ERRORS) or retries >= max_retries:
+                raise
+
+            print(e, f"Trying again in {retry_delay} seconds")
+            sleep(retry_delay)
+            retries += 1
+            continue
+
+        latency = perf_counter() - start
+        completion_usage = get_usage(usage)
+        # The output rate excludes the wait for the first token when known
+        generation_time = latency - (time_to_first_token or 0)
+
+        return (
+            message,
+            completion_usage,
+            {
+                "time_to_first_token": time_to_first_token,
+                "latency": latency,
+                "tokens_per_second": (
+                    completion_usage["completion_tokens"] / generation_time
+                    if generation_time > 0
+                    else 0
+                ),
+                "retries": retries,
+            },
         )
-    except Exception as e:
-        print(e, f"Trying again in {REQUEST_TIMEOUT_SECONDS} seconds")
-        sleep(REQUEST_TIMEOUT_SECONDS)
 
-        return send_prompt(api_key, model, user_prompt)
+
+def get_entries(training_data: TrainingData) -> list[TrainingDataEntry]:
+    return [
+        entry
+        for courses in training_data.values()
+        for projects in courses.values()
+        for submission_data in projects.values()
+        for entry in submission_data
+    ]
+
+
+def get_ai_grading(
+    client: OpenAI,
+    model: str,
+    entry: TrainingDataEntry,
+    stream: bool = False,
+    retry_delay: float = REQUEST_TIMEOUT_SECONDS,
+) -> AIGradingEntry:
+    ai_grading, usage, telemetry = send_prompt(
+        client, model, entry["user_prompt"], stream, retry_delay
+    )
+    ai_feedback = parse_feedback(ai_grading)
+
+    return {
+        "model": model,
+        "source_code_path": entry["source_code_path"],
+        "user_prompt": entry["user_prompt"],
+        "ai_feedback": {
+            "message": ai_grading,
+            "points": ai_feedback.points,
+            "structured": ai_feedback.to_dict(),
+        },
+        "actual_feedback": get_actual_feedback(entry),
+        "usage": usage,
+        "telemetry": telemetry,
+    }
+
+
+def get_actual_feedback(entry: TrainingDataEntry) -> Feedback:
+    return {
+        "message": entry["feedback"],
+        "points": entry["structured_feedback"]["points"],
+        "structured": entry["structured_feedback"],  # type: ignore
+    }
+
+
+def get_skipped_entry(model: str, entry: TrainingDataEntry) -> AIGradingEntry:
+    """Stands in for a submission skipped in an iteration of the adaptive mode
+    because its points had converged, so that the points comparisons of the
+    iterations stay aligned. Its AI points are SKIPPED_POINTS to tell it apart
+    from a grading whose points could not be parsed."""
+    return {
+        "model": model,
+        "source_code_path": entry["source_code_path"],
+        "user_prompt": entry["user_prompt"],
+        "ai_feedback": {
+            "message": "",
+            "points": {"overall_solution": SKIPPED_POINTS, "style": SKIPPED_POINTS},
+            "structured": {},
+        },
+        "actual_feedback": get_actual_feedback(entry),
+        "usage": {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0},
+        "telemetry": {
+            "time_to_first_token": None,
+            "latency": 0,
+            "tokens_per_second": 0,
+            "retries": 0,
+        },
+    }
 
 
 def get_ai_gradings(
-    api_key: str, model: str, training_data: TrainingData
-) -> AIGradingEntries:
-    ai_gradings: AIGradingEntries = []
-
-    for courses in training_data.values():
-        for projects in courses.values():
-            for submission_data in projects.values():
-                for entry in submission_data:
-                    ai_grading = send_prompt(api_key, model, entry["user_prompt"])
-                    ai_gradings.append(
-                        {
-                            "source_code_path": entry["source_code_path"],
-                            "user_prompt": entry["user_prompt"],
-                            "ai_feedback": {
-                                "message": ai_grading,
-                                "points": get_points_from_feedback(ai_grading),
-                            },
-                            "actual_feedback": {
-                                "message": entry["feedback"],
-                                "points": get_points_from_feedback(entry["feedback"]),
-                            },
-                        }
-                    )
+    client: OpenAI,
+    models: list[str],
+    training_data: TrainingData,
+    iterations: int = 1,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    stream: bool = False,
+    retry_delay: float = REQUEST_TIMEOUT_SECONDS,
+    on_complete: Optional[OnComplete] = None,
+) -> dict[tuple[str, int], AIGradingEntries]:
+    """Grades every submission with every model the given number of times.
+    All the (model, iteration, submission) jobs share one pool of
+    `concurrency` requests, and `on_complete` is called as soon as all the
+    jobs of a (model, iteration) have finished. Returns the gradings by
+    (model, iteration) in the submission order of the training data."""
+    entries = get_entries(training_data)
+    jobs = [
+        (model, iteration, index, entry)
+        for iteration in range(iterations)
+        for model in models
+        for index, entry in enumerate(entries)
+    ]
+    ai_gradings: dict[tuple[str, int], list[AIGradingEntry | None]] = {
+        (model, iteration): [None] * len(entries)
+        for iteration in range(iterations)
+        for model in models
+    }
+    remaining = {key: len(entries) for key in ai_gradings}
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    try:
+        futures = {
+            executor.submit(
+                get_ai_grading, client, model, entry, stream, retry_delay
+            ): (
+                model,
+                iteration,
+                index,
+            )
+            for model, iteration, index, entry in jobs
+        }
+
+        for future in as_completed(futures):
+            model, iteration, index = futures[future]
+            ai_gradings[(model, iteration)][index] = future.result()
+            remaining[(model, iteration)] -= 1
+
+            if on_complete and not remaining[(model, iteration)]:
+                on_complete(model, iteration, ai_gradings[(model, iteration)])
+    finally:
+        # Stops sending the queued requests on an error or an interrupt
+        executor.shutdown(cancel_futures=True)
+
+    return {
+        key: [grading for grading in gradings if grading]
+        for key, gradings in ai_gradings.items()
+    }
+
+
+def is_converged(
+    points: list[Points], min_iterations: int, max_ci_half_width: float
+) -> bool:
+    """Whether the 95% confidence intervals of the mean overall solution and
+    style points are within +-`max_ci_half_width`"""
+    if len(points) < min_iterations:
+        return False
+
+    for key in ("overall_solution", "style"):
+        values = [float(point[key]) for point in points if point[key]]  # type: ignore
+
+        if len(values) < 2:
+            return False
+
+        mean = sum(values) / len(values)
+        variance = sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+
+        if CONFIDENCE_Z * sqrt(variance / len(values)) > max_ci_half_width:
+            return False
+
+    return True
+
+
+def get_adaptive_ai_gradings(
+    client: OpenAI,
+    models: list[str],
+    training_data: TrainingData,
+    max_iterations: int,
+    min_iterations: int = DEFAULT_MIN_ITERATIONS,
+    max_ci_half_width: float = DEFAULT_MAX_CI_HALF_WIDTH,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    stream: bool = False,
+    retry_delay: float = REQUEST_TIMEOUT_SECONDS,
+    on_complete: Optional[OnComplete] = None,
+) -> dict[tuple[str, int], list[Optional[AIGradingEntry]]]:
+    """Grades every submission at least `min_iterations` times and keeps
+    re-grading the submissions whose points have not converged, see
+    `is_converged`, up to `max_iterations` times. The gradings of each
+    (model, iteration) are in the submission order of the training data, with
+    None for the submissions not graded in that iteration. `on_complete` is
+    called for each model at the end of each iteration."""
+    entries = get_entries(training_data)
+    ai_gradings: dict[tuple[str, int], list[Optional[AIGradingEntry]]] = {}
+    pending = [(model, index) for model in models for index in range(len(entries))]
+    total_gradings = 0
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    try:
+        for iteration in range(max_iterations):
+            for model in models:
+                ai_gradings[(model, iteration)] = [None] * len(entries)
+
+            futures = {
+                executor.submit(
+                    get_ai_grading,
+                    client,
+                    model,
+                    entries[index],
+                    stream,
+                    retry_delay,
+                ): (model, index)
+                for model, index in pending
+            }
+
+            for future, (model, index) in futures.items():
+                ai_gradings[(model, iteration)][index] = future.result()
+
+            if on_complete:
+                for model in models:
+                    on_complete(model, iteration, ai_gradings[(model, iteration)])
+
+            total_gradings += len(futures)
+            pending = [
+                (model, index)
+                for model, index in pending
+                if not is_converged(
+                    [
+                        grading["ai_feedback"]["points"]
+                        for previous_iteration in range(iteration + 1)
+                        if (grading := ai_gradings[(model, previous_iteration)][index])
+                    ],
+                    min_iterations,
+                    max_ci_half_width,
+                )
+            ]
+
+            print(
+                f"Iteration {iteration + 1}: {len(futures)} gradings, "
+                f"{len(models) * len(entries) - len(futures)} skipped, "
+                f"{len(pending)} submissions not converged"
+            )
+
+            if not pending:
+                break
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    print(
+        f"{total_gradings} gradings instead of "
+        f"{len(models) * len(entries) * max_iterations}"
+    )
 
     return ai_gradings
 
@@ -102,18 +436,88 @@ def get_points_comparison(ai_gradings: AIGradingEntries) -> tuple[str, str]:
     return overall_points, style_points
 
 
+def get_percentiles(values: list[float]) -> dict[str, float]:
+    """Nearest-rank percentiles of the values"""
+    if not values:
+        return {}
+
+    ordered = sorted(values)
+
+    return {
+        f"p{percentile}": ordered[max(0, -(-percentile * len(ordered) // 100) - 1)]
+        for percentile in PERCENTILES
+    }
+
+
+def get_telemetry_summary(
+    ai_gradings: AIGradingEntries,
+) -> dict[str, dict[str, float]]:
+    telemetries = [grading["telemetry"] for grading in ai_gradings]
+
+    return {
+        "time_to_first_token": get_percentiles(
+            [
+                telemetry["time_to_first_token"]
+                for telemetry in telemetries
+                if telemetry["time_to_first_token"] is not None
+            ]
+        ),
+        "latency": get_percentiles([telemetry["latency"] for telemetry in telemetries]),
+        "tokens_per_second": get_percentiles(
+            [telemetry["tokens_per_second"] for telemetry in telemetries]
+        ),
+        "retries": {"total": sum(telemetry["retries"] for telemetry in telemetries)},
+    }
+
+
+def get_request_rows(ai_gradings: AIGradingEntries) -> list[RequestRow]:
+    return [
+        {
+            "source_code_path": grading["source_code_path"],
+            **grading["usage"],
+            **grading["telemetry"],
+        }
+        for grading in ai_gradings
+    ]
+
+
+def get_telemetry(ai_gradings: AIGradingEntries) -> dict[str, Any]:
+    return {
+        "requests": [
+            {
+                "model": grading["model"],
+                "source_code_path": grading["source_code_path"],
+                "usage": grading["usage"],
+                **grading["telemetry"],
+            }
+            for grading in ai_gradings
+        ],
+        "summary": get_telemetry_summary(ai_gradings),
+    }
+
+
 def save_results(
     output_dir: str,
     ai_gradings: AIGradingEntries,
     overall_points_comparison: str,
     style_points_comparison: str,
+    run_name: str = "",
 ):
     pathname = f"{output_dir}/{datetime.now().strftime("%Y%m%d_%H%M%S")}"
 
+    if run_name:
+        # Fine-tuned model names contain characters not allowed in paths
+        pathname += "_" + re.sub(r"[^\w.-]", "_", run_name)
+
     os.mkdir(pathname)
+    results = [
+        {key: value for key, value in grading.items() if key != "telemetry"}
+        for grading in ai_gradings
+    ]
 
     for output_file, data_file in (
-        ("results.json", json.dumps(ai_gradings, ensure_ascii=False)),
+        ("results.json", json.dumps(results, ensure_ascii=False)),
+        ("telemetry.json", json.dumps(get_telemetry(ai_gradings), indent=2)),
         ("overall_points_comparison.csv", overall_points_comparison),
         ("style_points_comparison.csv", style_points_comparison),
     ):
@@ -125,32 +529,201 @@ def save_results(
             file.write(data_file)
 
 
+def print_cache_summary(ai_gradings: dict[tuple[str, int], AIGradingEntries]):
+    totals: dict[str, Usage] = {}
+
+    for (model, _), gradings in ai_gradings.items():
+        total = totals.setdefault(
+            model, {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        )
+
+        for grading in gradings:
+            for key in total:
+                total[key] += grading["usage"][key]  # type: ignore
+
+    for model, total in totals.items():
+        ratio = (
+            total["cached_tokens"] / total["prompt_tokens"]
+            if total["prompt_tokens"]
+            else 0
+        )
+        print(
+            f"{model}: {total['prompt_tokens']} prompt tokens, "
+            f"{total['cached_tokens']} cached ({ratio:.1%}), "
+            f"{total['completion_tokens']} completion tokens"
+        )
+
+
+def print_telemetry_summary(ai_gradings: dict[tuple[str, int], AIGradingEntries]):
+    gradings_by_model: dict[str, AIGradingEntries] = {}
+
+    for (model, _), gradings in ai_gradings.items():
+        gradings_by_model.setdefault(model, []).extend(gradings)
+
+    for model, gradings in gradings_by_model.items():
+        summary = get_telemetry_summary(gradings)
+        print(
+            f"{model}: {len(gradings)} requests, {summary['retries']['total']} retries"
+        )
+
+        for metric in ("time_to_first_token", "latency", "tokens_per_second"):
+            if summary[metric]:
+                print(
+                    f"  {metric}: "
+                    + ", ".join(
+                        f"{percentile} {value:.2f}"
+                        for percentile, value in summary[metric].items()
+                    )
+                )
+
+
+def get_run_name(model: str, iteration: int, models: list[str], iterations: int) -> str:
+    """Distinguishes the result directories saved within the same second"""
+    run_name_parts: list[str] = []
+
+    if len(models) > 1:
+        run_name_parts.append(model)
+
+    if iterations > 1:
+        run_name_parts.append(str(iteration))
+
+    return "_".join(run_name_parts)
+
+
+def get_grading_rows(ai_gradings: AIGradingEntries) -> list[GradingRow]:
+    return [
+        {
+            "source_code_path": grading["source_code_path"],
+            "user_prompt": grading["user_prompt"],
+            "ai_message": grading["ai_feedback"]["message"],
+            "ai_overall_solution": grading["ai_feedback"]["points"]["overall_solution"],
+            "ai_style": grading["ai_feedback"]["points"]["style"],
+            "actual_message": grading["actual_feedback"]["message"],
+            "actual_overall_solution": grading["actual_feedback"]["points"][
+                "overall_solution"
+            ],
+            "actual_style": grading["actual_feedback"]["points"]["style"],
+        }
+        for grading in ai_gradings
+    ]
+
+
 def main():
     parser = argparse.ArgumentParser()
 
     parser.add_argument("api_key")
-    parser.add_argument("model")
     parser.add_argument("courses_source_dir")
     parser.add_argument("courses_destination_dir")
     parser.add_argument("results_output_dir")
+    parser.add_argument("--models", nargs="+", default=[])
     parser.add_argument("--course")
     parser.add_argument("--iterations", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--run-manifest", action="append", default=[])
+    parser.add_argument("--results-store", choices=("files", "sqlite"), default="files")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--base-url")
+    parser.add_argument("--adaptive", action="store_true")
+    parser.add_argument("--min-iterations", type=int, default=DEFAULT_MIN_ITERATIONS)
+    parser.add_argument(
+        "--max-ci-half-width", type=float, default=DEFAULT_MAX_CI_HALF_WIDTH
+    )
 
     args = parser.parse_args()
 
-    for _ in range(args.iterations):
+    for run_manifest_file in args.run_manifest:
+        manifest = read_run_manifest(run_manifest_file)
+
+        if not manifest["fine_tuned_model"]:
+            parser.error(f"{run_manifest_file} has no fine-tuned model")
+
+        args.models.append(manifest["fine_tuned_model"])
+
+    if not args.models:
+        parser.error("Give --models or --run-manifest")
+
+    client = OpenAI(api_key=args.api_key, base_url=args.base_url)
+    training_data = get_training_data(
+        courses_source_dir=args.courses_source_dir,
+        code_files_dir=args.courses_destination_dir,
+        course=args.course,
+        workers=args.workers,
+    )
+    entries = get_entries(training_data)
+    connection: Optional[sqlite3.Connection] = None
+    run_id = 0
+
+    if args.results_store == "sqlite":
+        connection = connect(
+            os.path.join(args.results_output_dir, RESULTS_STORE_FILENAME)
+        )
+        run_id = create_run(connection)
+
+    def save(model: str, iteration: int, gradings: list[Optional[AIGradingEntry]]):
+        """Saves the (model, iteration) as soon as it is graded, so that an
+        interrupted run keeps the finished iterations"""
+        # The comparisons keep a row for every submission in every iteration,
+        # marking the ones skipped by the adaptive mode
+        compared_gradings = [
+            grading or get_skipped_entry(model, entry)
+            for grading, entry in zip(gradings, entries)
+        ]
+
+        if connection:
+            save_gradings(
+                connection,
+                run_id,
+                iteration,
+                model,
+                get_grading_rows(compared_gradings),
+            )
+            save_requests(
+                connection,
+                run_id,
+                iteration,
+                model,
+                get_request_rows([grading for grading in gradings if grading]),
+            )
+            return
+
+        overall_points, style_points = get_points_comparison(compared_gradings)
+        save_results(
+            args.results_output_dir,
+            [grading for grading in gradings if grading],
+            overall_points,
+            style_points,
+            run_name=get_run_name(model, iteration, args.models, args.iterations),
+        )
+
+    if args.adaptive:
+        ai_gradings = {
+            key: [grading for grading in gradings if grading]
+            for key, gradings in get_adaptive_ai_gradings(
+                client,
+                args.models,
+                training_data,
+                max_iterations=args.iterations,
+                min_iterations=args.min_iterations,
+                max_ci_half_width=args.max_ci_half_width,
+                concurrency=args.concurrency,
+                stream=args.stream,
+                on_complete=save,
+            ).items()
+        }
+    else:
         ai_gradings = get_ai_gradings(
-            args.api_key,
-            args.model,
-            get_training_data(
-                courses_source_dir=args.courses_source_dir,
-                code_files_dir=args.courses_destination_dir,
-                course=args.course,
-            ),
+            client,
+            args.models,
+            training_data,
+            iterations=args.iterations,
+            concurrency=args.concurrency,
+            stream=args.stream,
+            on_complete=save,
         )
-        overall_points, style_points = get_points_comparison(ai_gradings)
 
-        save_results(args.results_output_dir, ai_gradings, overall_points, style_points)
+    print_cache_summary(ai_gradings)
+    print_telemetry_summary(ai_gradings)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+import re
+
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+DEFAULT_INDENT_WIDTH = 2
+TAB_WIDTH = 4
+QT_GENERATED_PREFIXES = ("moc_", "ui_", "qrc_")
+# The first lines of the files written by moc, uic and rcc
+QT_GENERATED_MARKERS = (
+    "Meta object code from reading C++ file",
+    "Form generated from reading UI file",
+    "Resource object code",
+)
+INCLUDE_PATTERN = re.compile(r"^\s*#\s*include\b")
+RAW_STRING_START_PATTERN = re.compile(r'R"([^()\\\s]{0,16})\(')
+
+
+@dataclass(slots=True)
+class NormalizationOptions:
+    indent_width: int = DEFAULT_INDENT_WIDTH
+    drop_includes: bool = False
+    drop_generated: bool = False
+
+
+def is_qt_generated(file_name: str, source_code: str) -> bool:
+    return file_name.startswith(QT_GENERATED_PREFIXES) or any(
+        marker in source_code[:500] for marker in QT_GENERATED_MARKERS
+    )
+
+
+def expand_indentation(line: str) -> str:
+    """Expands the tabs of the indentation only, as tabs within string
+    literals are part of their value"""
+    stripped = line.lstrip(" \t")
+
+    return line[: len(line) - len(stripped)].expandtabs(TAB_WIDTH) + stripped
+
+
+def get_raw_string_end(line: str, start: int = 0) -> Optional[str]:
+    """Returns the terminator of a raw string literal left open on the line"""
+    match = RAW_STRING_START_PATTERN.search(line, start)
+
+    while match:
+        end = f'){match.group(1)}"'
+        close = line.find(end, match.end())
+
+        if close == -1:
+            return end
+
+        match = RAW_STRING_START_PATTERN.search(line, close + len(end))
+
+    return None
+
+
+def get_verbatim_lines(lines: list[str]) -> list[bool]:
+    """Marks the lines of multi-line raw string literals and the lines
+    continued from the previous line with a backslash, e.g. in string literals
+    and macros, whose whitespace can be part of a string value"""
+    verbatim: list[bool] = []
+    raw_string_end: Optional[str] = None
+    continued = False
+
+    for line in lines:
+        if raw_string_end:
+            verbatim.append(True)
+            close = line.find(raw_string_end)
+
+            if close != -1:
+                raw_string_end = get_raw_string_end(line, close + len(raw_string_end))
+        else:
+            raw_string_end = get_raw_string_end(line)
+            verbatim.append(continued or raw_string_end is not None)
+
+        # Backslashes within raw string literals do not continue the line
+        continued = not raw_string_end and line.rstrip(" \t").endswith("\\")
+
+    return verbatim
+
+
+def get_indent_unit(lines: list[str]) -> int:
+    """The width of one indentation level, i.e. the most common increase of
+    the indentation between consecutive lines"""
+    increases: Counter[int] = Counter()
+    previous = 0
+
+    for line in lines:
+        if not line:
+            continue
+
+        indentation = len(line) - len(line.lstrip(" "))
+
+        if indentation > previous:
+            increases[indentation - previous] += 1
+
+        previous = indentation
+
+    return increases.most_common(1)[0][0] if increases else TAB_WIDTH
+
+
+def normalize_source(source_code: str, options: NormalizationOptions) -> str:
+    """Removes the whitespace left by the comment removal without changing the
+    meaning of the code: trailing whitespace is trimmed, runs of blank lines
+    are collapsed into one and the indentation is rescaled to `indent_width`
+    spaces per level. The lines of multi-line raw string literals and the
+    lines continued with a backslash are kept as they are."""
+    original_lines = source_code.splitlines()
+    verbatim = get_verbatim_lines(original_lines)
+    lines = [
+        original_line if is_verbatim else expand_indentation(original_line).rstrip()
+        for original_line, is_verbatim in zip(original_lines, verbatim)
+    ]
+    unit = get_indent_unit(
+        [line for line, is_verbatim in zip(lines, verbatim) if not is_verbatim]
+    )
+    normalized: list[str] = []
+
+    for line, is_verbatim in zip(lines, verbatim):
+        if is_verbatim:
+            normalized.append(line)
+            continue
+
+        if options.drop_includes and INCLUDE_PATTERN.match(line):
+            continue
+
+        if not line:
+            if normalized and normalized[-1]:
+                normalized.append("")
+
+            continue
+
+        stripped = line.lstrip(" ")
+        depth, extra = divmod(len(line) - len(stripped), unit)
+        # Continuation lines aligned to a column keep their extra spaces
+        normalized.append(" " * (depth * options.indent_width + extra) + stripped)
+
+    while normalized and not normalized[-1]:
+        normalized.pop()
+
+    return "\n".join(normalized) + "\n" if normalized else ""
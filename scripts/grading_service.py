@@ -0,0 +1,381 @@
+"""Local grading service for getting AI pre-grades of single submissions
+
+The service keeps one OpenAI client and the feedback templates and grading
+instructions in memory, which are read again when their files change. The
+grading jobs are queued to a pool of workers calling the model, and the points
+are parsed from the AI feedback. A job fails when the request cannot be sent
+after the retries of send_prompt.
+
+Endpoints:
+POST /jobs       {"course", "project", "language", and either "submission_path"
+                 (a directory of code files) or "files" ({name: content} of
+                 uploaded code files), optionally "wait": true}
+GET  /jobs/<id>  The status of the job and the result when it has finished
+GET  /health
+
+The comments are removed from the .cpp and .hh files and the .ui files are
+summarized like in anonymize_cpp_files.py, both for the uploaded files and the
+files in the submission directory. Other files are not sent to the model.
+
+Usage:
+python grading_service.py serve <api_key> <courses_source_dir> (--model <model> | --run-manifest <file>) [--port <port>] [--workers <n>]
+python grading_service.py grade <submission_path> --course <course> --project <project> [--language <en|fi>] [--url <service url>]
+
+Example:
+python grading_service.py serve sk-... C:/courses --run-manifest run.json
+python grading_service.py grade C:/courses_code/2023_autumn/student_repositories/projekti1/<TUNI ID>/anonymized --course 2023_autumn --project projekti1
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import urllib.request
+import xml.etree.ElementTree as ElementTree
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Any, Iterable, Iterator, Literal, Optional, TypedDict
+from uuid import uuid4
+from openai import OpenAI
+from anonymize_cpp_files import remove_comments
+from compare_feedbacks import RequestTelemetry, Usage, send_prompt
+from prompt_data import ENCODING
+from prompt_data.constants import Language
+from prompt_data.data_gathering import get_assessment_texts, get_user_prompt_from_files
+from run_fine_tuning import read_run_manifest
+from submission_data import Points, get_points_from_feedback
+from ui_summarizer import summarize_ui
+
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 4
+# Finished jobs kept for GET /jobs/<id>
+MAX_FINISHED_JOBS = 1000
+DEFAULT_WAIT_SECONDS = 600
+
+
+class GradingRequest(TypedDict):
+    course: str
+    project: str
+    language: Language
+    submission_path: Optional[str]
+    files: Optional[dict[str, str]]
+
+
+class GradingResult(TypedDict):
+    message: str
+    points: Points
+    usage: Usage
+    telemetry: RequestTelemetry
+
+
+class Job(TypedDict):
+    id: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    created_at: str
+    result: Optional[GradingResult]
+    error: Optional[str]
+
+
+def get_source_files(files: Iterable[tuple[str, str]]) -> list[tuple[str, str]]:
+    """Removes the comments of the .cpp and .hh files and summarizes the .ui
+    files like anonymize_cpp_files.py. The .ui files already summarized by it
+    are kept as they are and the other files are left out."""
+    source_files: list[tuple[str, str]] = []
+
+    for name, content in files:
+        name = os.path.basename(name)
+
+        if name.endswith(".ui"):
+            if content.lstrip("\ufeff \t\r\n").startswith("<"):
+                content = summarize_ui(io.BytesIO(content.encode(ENCODING)))
+
+            source_files.append((name, content))
+        elif name.endswith((".cpp", ".hh")):
+            source_files.append((name, remove_comments(content)))
+
+    return source_files
+
+
+def read_source_files(submission_path: str) -> Iterator[tuple[str, str]]:
+    """Yields the names and contents of the code files directly in the
+    submission directory"""
+    for name in sorted(os.listdir(submission_path)):
+        path = os.path.join(submission_path, name)
+
+        if name.endswith((".cpp", ".hh", ".ui")) and os.path.isfile(path):
+            with open(path, "r", encoding=ENCODING, errors="replace") as file:
+                yield name, file.read()
+
+
+def get_grading_request(data: dict[str, Any]) -> GradingRequest:
+    """Validates the body of POST /jobs, raising a ValueError or a KeyError"""
+    files = data.get("files")
+    timeout = data.get("timeout", DEFAULT_WAIT_SECONDS)
+
+    if files is not None and (
+        not isinstance(files, dict)
+        or not all(
+            isinstance(name, str) and isinstance(content, str)
+            for name, content in files.items()
+        )
+    ):
+        raise ValueError('"files" must be an object of file names and contents')
+
+    if not isinstance(data["course"], str) or not isinstance(data["project"], str):
+        raise ValueError('"course" and "project" must be strings')
+
+    if not isinstance(data.get("submission_path", ""), (str, type(None))):
+        raise ValueError('"submission_path" must be a string')
+
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)):
+        raise ValueError('"timeout" must be a number of seconds')
+
+    return {
+        "course": data["course"],
+        "project": data["project"],
+        "language": Language(data.get("language", Language.EN)),
+        "submission_path": data.get("submission_path"),
+        "files": files,
+    }
+
+
+class GradingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        client: OpenAI,
+        model: str,
+        courses_source_dir: str,
+        workers: int,
+    ):
+        super().__init__(address, GradingRequestHandler)
+        self.client = client
+        self.model = model
+        self.courses_source_dir = courses_source_dir
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self.futures: dict[str, Future[None]] = {}
+        self.job_numbers = count(1)
+
+    def get_user_prompt(self, request: GradingRequest) -> str:
+        # The templates are cached until their files change, see
+        # get_assessment_texts
+        feedback_template, grading_instructions = get_assessment_texts(
+            os.path.join(
+                self.courses_source_dir, request["course"], "arvioinnit", "pohjat"
+            ),
+            request["project"],
+            request["language"],
+        )
+
+        if not feedback_template or not grading_instructions:
+            raise ValueError(
+                f"No feedback template or grading instructions for "
+                f"{request['course']}/{request['project']} ({request['language']})"
+            )
+
+        if request["files"]:
+            source_files = request["files"].items()
+        elif request["submission_path"] and os.path.isdir(request["submission_path"]):
+            source_files = read_source_files(request["submission_path"])
+        else:
+            raise ValueError(f"{request['submission_path']} is not a directory")
+
+        return get_user_prompt_from_files(
+            feedback_template, grading_instructions, get_source_files(source_files)
+        )
+
+    def run_job(self, job: Job, user_prompt: str):
+        job["status"] = "running"
+
+        try:
+            message, usage, telemetry = send_prompt(
+                self.client, self.model, user_prompt
+            )
+            job["result"] = {
+                "message": message,
+                "points": get_points_from_feedback(message),
+                "usage": usage,
+                "telemetry": telemetry,
+            }
+            job["status"] = "succeeded"
+        except Exception as e:
+            job["error"] = str(e)
+            job["status"] = "failed"
+
+        with self.lock:
+            self.futures.pop(job["id"], None)
+
+            while len(self.jobs) - len(self.futures) > MAX_FINISHED_JOBS:
+                oldest = next(
+                    job_id for job_id in self.jobs if job_id not in self.futures
+                )
+                del self.jobs[oldest]
+
+    def submit(self, request: GradingRequest) -> tuple[Job, Future[None]]:
+        # The prompt is built before queueing to report bad requests at once
+        user_prompt = self.get_user_prompt(request)
+        job: Job = {
+            "id": f"{next(self.job_numbers)}-{uuid4().hex[:8]}",
+            "status": "queued",
+            "created_at": datetime.now().isoformat(),
+            "result": None,
+            "error": None,
+        }
+
+        with self.lock:
+            self.jobs[job["id"]] = job
+            future = self.executor.submit(self.run_job, job, user_prompt)
+            self.futures[job["id"]] = future
+
+        return job, future
+
+
+class GradingRequestHandler(BaseHTTPRequestHandler):
+    server: GradingServer
+
+    def send_json(self, status: int, data: Any):
+        body = json.dumps(data, ensure_ascii=False).encode(ENCODING)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json_object(self) -> dict[str, Any]:
+        content_length = self.headers["Content-Length"]
+
+        if content_length is None:
+            raise ValueError("Content-Length is required")
+
+        data = json.loads(self.rfile.read(int(content_length)))
+
+        if not isinstance(data, dict):
+            raise ValueError("The request body must be a JSON object")
+
+        return data
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "model": self.server.model})
+            return
+
+        job_id = self.path.removeprefix("/jobs/")
+        job = self.server.jobs.get(job_id) if self.path.startswith("/jobs/") else None
+
+        if not job:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        self.send_json(200, job)
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        try:
+            data = self.read_json_object()
+            request = get_grading_request(data)
+            job, future = self.server.submit(request)
+        except (KeyError, ValueError, OSError, ElementTree.ParseError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        if data.get("wait"):
+            try:
+                future.result(timeout=data.get("timeout", DEFAULT_WAIT_SECONDS))
+            except TimeoutError:
+                pass
+
+        self.send_json(200 if job["status"] in ("succeeded", "failed") else 202, job)
+
+
+def serve(args: argparse.Namespace):
+    model = args.model
+
+    if args.run_manifest:
+        model = read_run_manifest(args.run_manifest)["fine_tuned_model"]
+
+    if not model:
+        sys.exit("Give --model or a --run-manifest with a fine-tuned model")
+
+    server = GradingServer(
+        (args.host, args.port),
+        OpenAI(api_key=args.api_key, base_url=args.base_url),
+        model,
+        args.courses_source_dir,
+        args.workers,
+    )
+
+    print(f"Grading with {model} on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        server.executor.shutdown(cancel_futures=True)
+
+
+def grade(args: argparse.Namespace):
+    request = urllib.request.Request(
+        f"{args.url}/jobs",
+        data=json.dumps(
+            {
+                "course": args.course,
+                "project": args.project,
+                "language": args.language,
+                "submission_path": os.path.abspath(args.submission_path),
+                "wait": True,
+            }
+        ).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+
+    with urllib.request.urlopen(request) as response:
+        job: Job = json.load(response)
+
+    if job["status"] != "succeeded" or not job["result"]:
+        sys.exit(f"Grading failed: {job['error']}")
+
+    print(job["result"]["message"], json.dumps(job["result"]["points"]), sep="\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(required=True)
+
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("api_key")
+    serve_parser.add_argument("courses_source_dir")
+    serve_parser.add_argument("--model")
+    serve_parser.add_argument("--run-manifest")
+    serve_parser.add_argument("--base-url")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    serve_parser.set_defaults(function=serve)
+
+    grade_parser = subparsers.add_parser("grade")
+    grade_parser.add_argument("submission_path")
+    grade_parser.add_argument("--course", required=True)
+    grade_parser.add_argument("--project", required=True)
+    grade_parser.add_argument("--language", type=Language, default=Language.EN)
+    grade_parser.add_argument("--url", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    grade_parser.set_defaults(function=grade)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import json
+import random
+from prompt_data import JsonlReader
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("data_file")
+    parser.add_argument("--metainfo-file")
+    parser.add_argument("--index", type=int, action="append")
+    parser.add_argument("--sample", type=int)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--language")
+    parser.add_argument("--course")
+    parser.add_argument("--project")
+
+    args = parser.parse_args()
+
+    with JsonlReader(args.data_file, args.metainfo_file) as reader:
+        print(f"{len(reader)} entries")
+
+        if args.index:
+            entries = [(index, reader[index]) for index in args.index]
+        elif args.language or args.course or args.project:
+            entries = list(reader.filter(args.language, args.course, args.project))
+
+            if args.sample:
+                entries = random.Random(args.seed).sample(
+                    entries, min(args.sample, len(entries))
+                )
+        elif args.sample:
+            entries = reader.sample(args.sample, args.seed)
+        else:
+            entries = []
+
+        for index, entry in entries:
+            print(f"=== {index}")
+            print(json.dumps(entry, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Measures the throughput and tail latency of the grading requests of
+compare_feedbacks.py
+
+Synthetic submissions are graded with `get_ai_gradings` against a mock
+server started in the background, or against the server given with
+--base-url. Each concurrency level is run separately so that they can be
+compared.
+
+The OpenAI client retries the 429 and 5xx responses itself (--max-retries).
+Only the requests failing all of its retries count as retries of
+`send_prompt`, which waits --retry-delay seconds before trying again.
+
+Usage:
+python load_test_grading.py [--submissions <n>] [--concurrency <n> ...] [--stream] [--base-url <url>]
+
+Example:
+python load_test_grading.py --submissions 200 --concurrency 1 8 32 --latency-median 1 --rate-limit-rate 0.05
+"""
+
+import argparse
+
+from time import perf_counter
+from openai import OpenAI
+from compare_feedbacks import get_ai_gradings, get_telemetry_summary
+from mock_openai_server import add_settings_arguments, get_settings, start_server
+from prompt_data import TrainingData
+from prompt_data.constants import DENOTIONS, Language
+from submission_data import parse_feedback
+
+MOCK_MODEL = "mock-model"
+FEEDBACK = "OVERALL SOLUTION: 4\n+ Works\nPROGRAMMING STYLE: 3\n- Long functions"
+
+
+def get_synthetic_training_data(submissions: int, prompt_chars: int) -> TrainingData:
+    structured_feedback = parse_feedback(FEEDBACK).to_dict()
+    instructions = f"{DENOTIONS['instructions']}\n{'Implement the project. ' * 20}\n"
+    code = "int main() { return 0; }\n" * (prompt_chars // 25)
+
+    return {
+        Language.EN: {
+            "load_test": {
+                "project": [
+                    {
+                        "source_code_path": f"submission_{i}",
+                        "course_assistant": "load_test",
+                        "user_prompt": (
+                            f"{instructions}{DENOTIONS['file']} main.cpp\n"
+                            f"// submission {i}\n{code}"
+                        ),
+                        "feedback": FEEDBACK,
+                        "structured_feedback": structured_feedback,  # type: ignore
+                    }
+                    for i in range(submissions)
+                ]
+            }
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--base-url")
+    parser.add_argument("--api-key", default="mock")
+    parser.add_argument("--model", default=MOCK_MODEL)
+    parser.add_argument("--submissions", type=int, default=100)
+    parser.add_argument("--prompt-chars", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8])
+    parser.add_argument("--max-retries", type=int, default=2)
+    parser.add_argument("--retry-delay", type=float, default=1)
+    parser.add_argument("--stream", action="store_true")
+    add_settings_arguments(parser)
+
+    args = parser.parse_args()
+    base_url = args.base_url
+
+    if not base_url:
+        base_url = start_server(get_settings(args)).base_url
+
+    client = OpenAI(
+        api_key=args.api_key, base_url=base_url, max_retries=args.max_retries
+    )
+    training_data = get_synthetic_training_data(args.submissions, args.prompt_chars)
+
+    print(f"Grading {args.submissions} submissions with {base_url}")
+
+    for concurrency in args.concurrency:
+        start = perf_counter()
+        ai_gradings = get_ai_gradings(
+            client,
+            [args.model],
+            training_data,
+            concurrency=concurrency,
+            stream=args.stream,
+            retry_delay=args.retry_delay,
+        )
+        elapsed = perf_counter() - start
+        gradings = ai_gradings[(args.model, 0)]
+        summary = get_telemetry_summary(gradings)
+        completion_tokens = sum(
+            grading["usage"]["completion_tokens"] for grading in gradings
+        )
+
+        print(
+            f"Concurrency {concurrency}: {len(gradings) / elapsed:.2f} requests/s, "
+            f"{completion_tokens / elapsed:.0f} completion tokens/s, "
+            f"{summary['retries']['total']} retries, {elapsed:.1f} s in total"
+        )
+
+        for metric in ("time_to_first_token", "latency"):
+            if summary[metric]:
+                print(
+                    f"  {metric}: "
+                    + ", ".join(
+                        f"{percentile} {value:.3f} s"
+                        for percentile, value in summary[metric].items()
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
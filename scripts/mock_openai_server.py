@@ -0,0 +1,441 @@
+"""Local stand-in for the OpenAI API used by compare_feedbacks.py and
+run_fine_tuning.py
+
+Serves chat completions (also streamed), file uploads and fine-tuning jobs
+without using API credits. The completions are canned gradings with random
+points. The response times follow a log-normal distribution, and errors and
+429 rate limit responses can be injected.
+
+With --seed, the random choices of each request are drawn from a generator
+seeded with the seed, the request body and the number of earlier requests with
+the same body. The responses to the same requests are then the same however
+the concurrent requests are interleaved.
+
+Usage:
+python mock_openai_server.py [--port <port>] [--latency-median <seconds>] [--error-rate <0-1>] [--rate-limit-rate <0-1>]
+
+Example:
+python mock_openai_server.py --port 8000 --latency-median 2 --max-concurrent-requests 16
+python compare_feedbacks.py key ... --models gpt-4o --base-url http://localhost:8000/v1
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from time import sleep, time
+from typing import Any, Optional
+from submission_data.constants import OverallSolution
+
+CHARACTERS_PER_TOKEN = 4
+FILLER_LINE = "+ The solution follows the instructions."
+
+
+@dataclass(slots=True)
+class MockSettings:
+    # Median and log-normal sigma of the time to the first token in seconds
+    latency_median: float = 0.5
+    latency_sigma: float = 0.5
+    tokens_per_second: float = 100
+    completion_lines: int = 20
+    max_overall_solution_points: int = 5
+    max_style_points: int = 5
+    error_rate: float = 0
+    rate_limit_rate: float = 0
+    # Requests over the limit are rejected with 429 like an exhausted quota
+    max_concurrent_requests: int = 0
+    retry_after: float = 1
+    fine_tuning_polls: int = 2
+    seed: Optional[int] = None
+
+
+class MockState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active_requests = 0
+        self.ids = count(1)
+        self.job_polls: dict[str, int] = {}
+        # The number of requests by the hash of their body
+        self.request_counts: dict[str, int] = {}
+
+
+def get_completion_text(settings: MockSettings, rng: random.Random) -> str:
+    overall_points = rng.randint(0, settings.max_overall_solution_points)
+    style_points = rng.randint(0, settings.max_style_points)
+
+    return "\n".join(
+        (
+            f"{OverallSolution.EN}: {overall_points}",
+            *[FILLER_LINE] * (settings.completion_lines // 2),
+            f"PROGRAMMING STYLE: {style_points}",
+            *[FILLER_LINE] * (settings.completion_lines // 2),
+        )
+    )
+
+
+def get_usage(messages: list[dict[str, str]], completion: str) -> dict[str, int]:
+    prompt_tokens = sum(len(message["content"]) for message in messages)
+    prompt_tokens //= CHARACTERS_PER_TOKEN
+    completion_tokens = len(completion) // CHARACTERS_PER_TOKEN
+
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def get_fine_tuning_job(
+    job_id: str, body: dict[str, Any], status: str, fine_tuned_model: Optional[str]
+) -> dict[str, Any]:
+    return {
+        "id": job_id,
+        "object": "fine_tuning.job",
+        "created_at": int(time()),
+        "model": body.get("model", ""),
+        "fine_tuned_model": fine_tuned_model,
+        "status": status,
+        "organization_id": "org-mock",
+        "result_files": [],
+        "seed": 0,
+        "training_file": body.get("training_file", ""),
+        "validation_file": body.get("validation_file"),
+        "hyperparameters": {"n_epochs": "auto"},
+        "error": None,
+        "finished_at": None,
+        "trained_tokens": None,
+    }
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockServer"
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+    def send_json(
+        self,
+        status: int,
+        data: dict[str, Any],
+        headers: Optional[dict[str, str]] = None,
+    ):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(
+        self, status: int, message: str, headers: Optional[dict[str, str]] = None
+    ):
+        self.send_json(status, {"error": {"message": message, "type": "mock"}}, headers)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def read_json(self, body: bytes) -> Optional[dict[str, Any]]:
+        """Parses the request body, replying 400 if it is not a JSON object"""
+        try:
+            data = json.loads(body)
+        except json.JSONDecodeError as e:
+            self.send_error_json(400, f"Invalid JSON: {e}")
+            return None
+
+        if not isinstance(data, dict):
+            self.send_error_json(400, "The request body must be a JSON object")
+            return None
+
+        return data
+
+    def get_rng(self, body: bytes) -> random.Random:
+        """A generator for the random choices of the request, reproducible
+        with a seed regardless of the order of the concurrent requests"""
+        seed = self.server.settings.seed
+
+        if seed is None:
+            return random.Random()
+
+        state = self.server.state
+        digest = hashlib.sha256(body).hexdigest()
+
+        with state.lock:
+            occurrence = state.request_counts.get(digest, 0)
+            state.request_counts[digest] = occurrence + 1
+
+        return random.Random(f"{seed}:{digest}:{occurrence}")
+
+    def do_POST(self):
+        body = self.read_body()
+
+        if self.path.endswith("/chat/completions"):
+            request = self.read_json(body)
+
+            if request is not None:
+                self.handle_chat_completion(request, self.get_rng(body))
+        elif self.path.endswith("/files"):
+            self.send_json(
+                200,
+                {
+                    "id": f"file-{next(self.server.state.ids)}",
+                    "object": "file",
+                    "bytes": len(body),
+                    "created_at": int(time()),
+                    "filename": "upload.jsonl",
+                    "purpose": "fine-tune",
+                    "status": "processed",
+                },
+            )
+        elif self.path.endswith("/fine_tuning/jobs"):
+            data = self.read_json(body)
+
+            if data is None:
+                return
+
+            job_id = f"ftjob-{next(self.server.state.ids)}"
+
+            with self.server.state.lock:
+                self.server.state.job_polls[job_id] = 0
+                self.server.jobs[job_id] = data
+
+            self.send_json(200, get_fine_tuning_job(job_id, data, "queued", None))
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}")
+
+    def do_GET(self):
+        job_id = self.path.rstrip("/").rsplit("/", 1)[-1]
+
+        if "/fine_tuning/jobs/" not in self.path or job_id not in self.server.jobs:
+            self.send_error_json(404, f"Unknown path {self.path}")
+            return
+
+        with self.server.state.lock:
+            self.server.state.job_polls[job_id] += 1
+            polls = self.server.state.job_polls[job_id]
+
+        data = self.server.jobs[job_id]
+
+        if polls > self.server.settings.fine_tuning_polls:
+            job = get_fine_tuning_job(
+                job_id, data, "succeeded", f"ft:{data.get('model')}:mock:{job_id}"
+            )
+        else:
+            job = get_fine_tuning_job(job_id, data, "running", None)
+
+        self.send_json(200, job)
+
+    def send_rate_limit_error(self):
+        self.send_error_json(
+            429,
+            "Rate limit reached",
+            {"Retry-After": str(self.server.settings.retry_after)},
+        )
+
+    def handle_chat_completion(self, request: dict[str, Any], rng: random.Random):
+        settings = self.server.settings
+        state = self.server.state
+
+        with state.lock:
+            over_limit = (
+                settings.max_concurrent_requests > 0
+                and state.active_requests >= settings.max_concurrent_requests
+            )
+
+            if not over_limit:
+                state.active_requests += 1
+
+        if over_limit:
+            self.send_rate_limit_error()
+            return
+
+        try:
+            if rng.random() < settings.rate_limit_rate:
+                self.send_rate_limit_error()
+                return
+
+            if rng.random() < settings.error_rate:
+                self.send_error_json(500, "Injected server error")
+                return
+
+            completion = get_completion_text(settings, rng)
+            usage = get_usage(request["messages"], completion)
+            sleep(
+                settings.latency_median * rng.lognormvariate(0, settings.latency_sigma)
+            )
+            response = {
+                "id": f"chatcmpl-{next(state.ids)}",
+                "created": int(time()),
+                "model": request["model"],
+            }
+
+            if request.get("stream"):
+                self.stream_completion(response, completion, usage, request)
+                return
+
+            sleep(usage["completion_tokens"] / settings.tokens_per_second)
+            self.send_json(
+                200,
+                {
+                    **response,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": completion},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+        finally:
+            with state.lock:
+                state.active_requests -= 1
+
+    def stream_completion(
+        self,
+        response: dict[str, Any],
+        completion: str,
+        usage: dict[str, int],
+        request: dict[str, Any],
+    ):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        # The client may stop reading at [DONE] and drop the connection
+        self.send_header("Connection", "close")
+        self.close_connection = True
+        self.end_headers()
+
+        def send_event(data: str):
+            event = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+
+        def send_chunk(choices: list[dict[str, Any]], **fields: Any):
+            send_event(
+                json.dumps(
+                    {
+                        **response,
+                        "object": "chat.completion.chunk",
+                        "choices": choices,
+                        **fields,
+                    }
+                )
+            )
+
+        lines = completion.splitlines(keepends=True)
+        # Lines are sent at the configured output rate
+        delay = usage["completion_tokens"] / self.server.settings.tokens_per_second
+        delay /= max(len(lines), 1)
+
+        for line in lines:
+            send_chunk(
+                [{"index": 0, "delta": {"content": line}, "finish_reason": None}]
+            )
+            sleep(delay)
+
+        send_chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+
+        if request.get("stream_options", {}).get("include_usage"):
+            send_chunk([], usage=usage)
+
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], settings: MockSettings):
+        super().__init__(address, MockRequestHandler)
+        self.settings = settings
+        self.state = MockState()
+        self.jobs: dict[str, dict[str, Any]] = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+
+        return f"http://{host}:{port}/v1"
+
+
+def start_server(settings: MockSettings, host: str = "127.0.0.1", port: int = 0):
+    """Serves in a background thread. With port 0 a free port is used, see
+    `MockServer.base_url`."""
+    server = MockServer((host, port), settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def add_settings_arguments(parser: argparse.ArgumentParser):
+    defaults = MockSettings()
+
+    parser.add_argument("--latency-median", type=float, default=defaults.latency_median)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=defaults.tokens_per_second
+    )
+    parser.add_argument(
+        "--completion-lines", type=int, default=defaults.completion_lines
+    )
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument(
+        "--rate-limit-rate", type=float, default=defaults.rate_limit_rate
+    )
+    parser.add_argument(
+        "--max-concurrent-requests", type=int, default=defaults.max_concurrent_requests
+    )
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument(
+        "--fine-tuning-polls", type=int, default=defaults.fine_tuning_polls
+    )
+    parser.add_argument("--seed", type=int)
+
+
+def get_settings(args: argparse.Namespace) -> MockSettings:
+    return MockSettings(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        completion_lines=args.completion_lines,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        max_concurrent_requests=args.max_concurrent_requests,
+        retry_after=args.retry_after,
+        fine_tuning_polls=args.fine_tuning_polls,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_settings_arguments(parser)
+
+    args = parser.parse_args()
+    server = MockServer((args.host, args.port), get_settings(args))
+
+    print(f"Serving on {server.base_url}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,31 @@
 import argparse
 import os
 import json
+from typing import Literal
+from cpp_normalizer import DEFAULT_INDENT_WIDTH, NormalizationOptions
 from prompt_data import (
-    ENCODING,
-    get_formatted_training_data,
-    get_total_lines,
+    Partition,
+    PartitionWriter,
+    ShardedPartitionWriter,
     get_training_data,
+    select_training_data,
+    write_manifest,
+    write_training_files,
 )
+from prompt_data.types import ArchivedSubmissions, Summary
+from remove_non_consent_repos import get_consent_index
+from repository_archive import read_archived_submissions
+
+
+def get_total_entries(
+    summary: Summary, key: Literal["training_entries", "validation_entries"]
+) -> int:
+    return sum(
+        log_entry[key]
+        for courses in summary.values()
+        for projects in courses.values()
+        for log_entry in projects.values()
+    )
 
 
 def main():
@@ -21,36 +40,138 @@ def main():
     parser.add_argument("--max-entries")
     parser.add_argument("--target-language")
     parser.add_argument("--training-data-percentage")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--max-shard-bytes", type=int)
+    parser.add_argument("--max-shard-entries", type=int)
+    parser.add_argument("--max-shard-tokens", type=int)
+    parser.add_argument("--manifest-output-file")
+    parser.add_argument("--token-budget", type=int)
+    parser.add_argument("--diversity", action="store_true")
+    parser.add_argument("--selection-seed", type=int)
+    # Reads the code files of a project from a zip or tar archive of the
+    # student repositories instead of the anonymized directories
+    parser.add_argument(
+        "--archive",
+        nargs=5,
+        action="append",
+        metavar=("COURSE", "PROJECT", "PATH", "ROUND_DIR", "ASSIGNMENT_DIR"),
+    )
+    # The archives are not filtered by remove_non_consent_repos.py, so they
+    # require the consent and students files
+    parser.add_argument("--consent-file")
+    parser.add_argument("--students-file")
+    parser.add_argument("--consent-index-file")
+    parser.add_argument("--normalize", action="store_true")
+    parser.add_argument("--indent-width", type=int, default=DEFAULT_INDENT_WIDTH)
+    parser.add_argument("--drop-includes", action="store_true")
+    parser.add_argument("--drop-generated", action="store_true")
+    parser.add_argument("--summarize-ui", action="store_true")
 
     args = parser.parse_args()
+
+    if (args.drop_includes or args.drop_generated) and not args.normalize:
+        parser.error("--drop-includes and --drop-generated require --normalize")
+
+    if args.archive and not (args.consent_file and args.students_file):
+        parser.error("--archive requires --consent-file and --students-file")
+
+    options = (
+        NormalizationOptions(
+            indent_width=args.indent_width,
+            drop_includes=args.drop_includes,
+            drop_generated=args.drop_generated,
+        )
+        if args.normalize
+        else None
+    )
+    archived_submissions: ArchivedSubmissions = {}
+    consents = (
+        get_consent_index(
+            args.consent_file, args.students_file, args.consent_index_file
+        )
+        if args.archive
+        else {}
+    )
+
+    for course, project, archive_path, round_dir, assignment_dir in args.archive or []:
+        for student_id, archived in read_archived_submissions(
+            archive_path,
+            round_dir,
+            assignment_dir,
+            consents,
+            options,
+            args.summarize_ui,
+        ).items():
+            archived_submissions[(course, project, student_id)] = archived
+
     training_data = get_training_data(
         courses_source_dir=args.courses_source_dir,
         code_files_dir=args.courses_destination_dir,
         course=args.course,
         max_entries=int(args.max_entries) if args.max_entries else None,
         target_language=args.target_language,
+        workers=args.workers,
+        archived_submissions=archived_submissions,
     )
+
+    if args.token_budget:
+        selection = select_training_data(
+            training_data, args.token_budget, args.diversity, args.selection_seed
+        )
+        training_data = selection["training_data"]
+        print(
+            f"Selected {selection['entries']} entries with {selection['tokens']} "
+            f"tokens. Coverage: "
+            + ", ".join(
+                f"{kind} {covered}/{total}"
+                for kind, (covered, total) in selection["coverage"].items()
+            )
+        )
+
     training_data_percentage = (
         float(args.training_data_percentage) if args.training_data_percentage else 0.8
     )
-    training_partition, validation_partition, summary = get_formatted_training_data(
-        training_data, training_data_percentage
+    is_sharded = bool(
+        args.max_shard_bytes or args.max_shard_entries or args.max_shard_tokens
     )
+    writers = {
+        partition: (
+            ShardedPartitionWriter(
+                path,
+                max_bytes=args.max_shard_bytes,
+                max_entries=args.max_shard_entries,
+                max_tokens=args.max_shard_tokens,
+            )
+            if is_sharded
+            else PartitionWriter(path)
+        )
+        for partition, path in (
+            (Partition.Training, args.training_data_output_file),
+            (Partition.Validation, args.validation_data_output_file),
+        )
+    }
+
+    try:
+        summary = write_training_files(
+            training_data,
+            training_data_percentage,
+            writers,
+            args.metainfo_output_file,
+        )
+    finally:
+        for writer in writers.values():
+            writer.close()
 
-    for output_file, data_file in (
-        (args.training_data_output_file, training_partition),
-        (args.validation_data_output_file, validation_partition),
-        (args.metainfo_output_file, json.dumps(training_data, ensure_ascii=False)),
-    ):
-        with open(
-            output_file,
-            "w",
-            encoding=ENCODING,
-        ) as file:
-            file.write(data_file)
+    if is_sharded:
+        write_manifest(
+            args.manifest_output_file
+            or f"{os.path.splitext(args.training_data_output_file)[0]}.manifest.json",
+            writers,
+        )
 
     print(
-        f"Total:\nTraining: {get_total_lines(training_partition)}\nValidation: {get_total_lines(validation_partition)}",
+        f"Total:\nTraining: {get_total_entries(summary, 'training_entries')}\n"
+        f"Validation: {get_total_entries(summary, 'validation_entries')}",
         json.dumps(summary, indent=2),
         sep=os.linesep,
     )
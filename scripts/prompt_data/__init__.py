@@ -1,5 +1,17 @@
-from .constants import ENCODING, SYSTEM_MESSAGE_CONTENT
-from .types import TrainingData
+from .constants import ENCODING, SYSTEM_MESSAGE_CONTENT, Partition
+from .types import MetainfoEntry, TrainingData, TrainingDataEntry
+from .serialization import dumps
+from .tokens import count_tokens
+from .export import (
+    PartitionWriter,
+    ShardedPartitionWriter,
+    resolve_metainfo_file_path,
+    write_entry,
+    write_manifest,
+    write_training_files,
+)
+from .jsonl_reader import JsonlReader
+from .selection import Selection, select_training_data
 from .data_gathering import (
     get_formatted_training_data,
     get_total_lines,
@@ -9,8 +21,22 @@ from .data_gathering import (
 __all__ = (
     "ENCODING",
     "SYSTEM_MESSAGE_CONTENT",
+    "JsonlReader",
+    "MetainfoEntry",
+    "Partition",
+    "PartitionWriter",
+    "Selection",
+    "ShardedPartitionWriter",
     "TrainingData",
+    "TrainingDataEntry",
+    "count_tokens",
+    "dumps",
     "get_formatted_training_data",
     "get_total_lines",
     "get_training_data",
+    "resolve_metainfo_file_path",
+    "select_training_data",
+    "write_entry",
+    "write_manifest",
+    "write_training_files",
 )
@@ -6,6 +6,11 @@ class Language(StrEnum):
     FI = "fi"
 
 
+class Partition(StrEnum):
+    Training = "training"
+    Validation = "validation"
+
+
 ENCODING = "utf-8"
 DENOTIONS = {
     key: f"//{value}:"
@@ -1,48 +1,97 @@
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import batched
+from submission_data import FeedbackParser
 from submission_data.constants import OverallSolution
 from .openai import get_training_prompt
 from .constants import DENOTIONS, ENCODING
-from .types import Language, TrainingData, TrainingDataEntry, Summary
-from typing import Optional
-
-
-def get_parsed_feedback(feedback_form: str) -> str:
+from .types import (
+    ArchivedSubmissions,
+    Language,
+    ParsedFeedback,
+    Submission,
+    TrainingData,
+    TrainingDataEntry,
+    Summary,
+)
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+R = TypeVar("R")
+FEEDBACK_START_MARKERS = (
+    "Saat 0 pistettä",
+    "You have received zero",
+    OverallSolution.EN,
+    OverallSolution.FI,
+)
+FEEDBACK_END_MARKERS = ("VERSIONHALLINNAN KÄYTTÖ", "VERSION CONTROL")
+LANGUAGE_MARKERS = (
+    ("Assessed submission:", Language.EN),
+    ("Tarkastettu palautus:", Language.FI),
+)
+
+
+def parse_feedback_lines(lines: Iterable[str]) -> ParsedFeedback:
     """
-    Skips unwanted parts of the feedback form and returns a the feedback in
-    a condensed form
+    Detects the language, skips unwanted parts of the feedback form and
+    collects the feedback both in a condensed form and as a structured
+    feedback in a single pass over the lines
     """
-    feedback = ""
+    language: Language | None = None
+    feedback_lines: list[str] = []
+    feedback_parser = FeedbackParser()
     ignore_lines = True
+    feedback_ended = False
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+
+        if not language:
+            language = next(
+                (language for marker, language in LANGUAGE_MARKERS if marker in line),
+                None,
+            )
+
+        if feedback_ended:
+            if language:
+                break
+
+            continue
 
-    for line in feedback_form.splitlines():
         if ignore_lines:
-            if line.startswith(
-                (
-                    "Saat 0 pistettä",
-                    "You have received zero",
-                    OverallSolution.EN,
-                    OverallSolution.FI,
-                )
-            ):
+            if line.startswith(FEEDBACK_START_MARKERS):
                 ignore_lines = False
             else:
                 continue
 
-        if line.startswith(("VERSIONHALLINNAN KÄYTTÖ", "VERSION CONTROL")):
-            break
+        if line.startswith(FEEDBACK_END_MARKERS):
+            feedback_ended = True
+
+            if language:
+                break
 
-        if not line or line.startswith(
-            (
-                "\n",
-                "===================================",
-            )
-        ):
             continue
 
-        feedback += line + "\n"
+        if not line or line.startswith("==================================="):
+            continue
 
-    return feedback
+        feedback_lines.append(line + "\n")
+        feedback_parser.feed(line)
+
+    return {
+        "language": language,
+        "feedback": "".join(feedback_lines),
+        "structured_feedback": feedback_parser.get_feedback(),
+    }
+
+
+def get_parsed_feedback(feedback_form: str) -> str:
+    """
+    Skips unwanted parts of the feedback form and returns a the feedback in
+    a condensed form
+    """
+    return parse_feedback_lines(feedback_form.splitlines())["feedback"]
 
 
 def get_parsed_instructions(feedback_form_path: str) -> str:
@@ -70,24 +119,37 @@ def get_parsed_instructions(feedback_form_path: str) -> str:
     return instructions
 
 
-def get_feedback_from_file(course_assistant_path: str, student_id: str) -> str:
-    with open(
-        os.path.join(course_assistant_path, student_id, "palaute.txt"),
-        "r",
-        encoding=ENCODING,
-    ) as file:
-        return file.read()
-
-
-def get_language(feedback_raw: str) -> Language | None:
-    if "Assessed submission:" in feedback_raw:
-        return Language.EN
-    elif "Tarkastettu palautus:" in feedback_raw:
-        return Language.FI
+def parse_feedback_file(feedback_path: str) -> ParsedFeedback:
+    with open(feedback_path, "r", encoding=ENCODING) as file:
+        return parse_feedback_lines(file)
 
 
 def get_assessment_texts(
     grading_instructions_path: str, project: str, language: Language
+) -> tuple[str, str]:
+    """Returns the feedback template and the grading instructions of the
+    project. They are read again when a file of the project has been added,
+    removed or modified."""
+    return read_assessment_texts(
+        grading_instructions_path,
+        project,
+        language,
+        tuple(
+            sorted(
+                (entry.name, entry.stat().st_mtime_ns)
+                for entry in os.scandir(grading_instructions_path)
+                if entry.name.startswith(project)
+            )
+        ),
+    )
+
+
+@lru_cache
+def read_assessment_texts(
+    grading_instructions_path: str,
+    project: str,
+    language: Language,
+    fingerprint: tuple[tuple[str, int], ...],
 ) -> tuple[str, str]:
     feedback_template = ""
     grading_instructions = ""
@@ -116,15 +178,30 @@ def get_assessment_texts(
 def get_user_prompt(
     feedback_base: str, grading_instructions: str, anonymized_path: str
 ) -> str:
+    def read_source_files() -> Iterator[tuple[str, str]]:
+        for source_file in os.listdir(anonymized_path):
+            with open(
+                os.path.join(anonymized_path, source_file),
+                "r",
+                encoding=ENCODING,
+            ) as file:
+                yield source_file, file.read()
+
+    return get_user_prompt_from_files(
+        feedback_base, grading_instructions, read_source_files()
+    )
+
+
+def get_user_prompt_from_files(
+    feedback_base: str,
+    grading_instructions: str,
+    source_files: Iterable[tuple[str, str]],
+) -> str:
+    """Assembles the prompt from the names and contents of the code files"""
     user_prompt = f"{feedback_base}\n{grading_instructions}\n"
 
-    for source_file in os.listdir(anonymized_path):
-        with open(
-            os.path.join(anonymized_path, source_file),
-            "r",
-            encoding=ENCODING,
-        ) as file:
-            user_prompt += f"{DENOTIONS["file"]}{source_file}\n{file.read()}\n"
+    for source_file, source_code in source_files:
+        user_prompt += f"{DENOTIONS["file"]}{source_file}\n{source_code}\n"
 
     return user_prompt
 
@@ -135,9 +212,15 @@ def get_training_data(
     course: Optional[str] = None,
     max_entries: Optional[int] = None,
     target_language: Optional[Language] = None,
+    workers: Optional[int] = None,
+    archived_submissions: Optional[ArchivedSubmissions] = None,
 ) -> TrainingData:
     """Creates a training data object which can be used to fine-tune an OpenAI
-    model. Assumes the following directory structures:
+    model. With more than one worker, the files are read and the prompts
+    assembled in a thread pool while keeping the order of the entries. The
+    code files of the `archived_submissions` are used instead of the
+    anonymized directories.
+    Assumes the following directory structures:
 
     <courses_source_dir>/
     ├── <course 1>/
@@ -190,23 +273,64 @@ def get_training_data(
         Language.FI: {},
         Language.EN: {},
     }
+    course_dirs = get_course_dirs(courses_source_dir, course)
     count = 0
 
-    for course_dir in os.listdir(courses_source_dir):
-        course_path = os.path.join(courses_source_dir, course_dir)
+    for course_dir in course_dirs:
+        training_data[Language.FI][course_dir] = {}
+        training_data[Language.EN][course_dir] = {}
 
-        if not os.path.isdir(course_path) or (course and course_dir != course):
+    submissions = get_submissions(
+        courses_source_dir, code_files_dir, course_dirs, archived_submissions
+    )
+
+    for submission, result in (
+        map_in_parallel(get_entry, submissions, target_language, workers)
+        if workers and workers > 1
+        else (
+            (submission, get_entry(submission, target_language))
+            for submission in submissions
+        )
+    ):
+        if max_entries and count >= max_entries:
+            break
+
+        if not result:
             continue
 
-        gradings_path = os.path.join(course_path, "arvioinnit")
+        language, data = result
+        project = submission["project"]
+        count += 1
 
-        if not os.path.isdir(gradings_path):
-            continue
+        if project in training_data[language][submission["course"]]:
+            training_data[language][submission["course"]][project].append(data)
+        else:
+            training_data[language][submission["course"]][project] = [data]
 
-        grading_instructions_path = os.path.join(gradings_path, "pohjat")
+    return training_data
 
-        training_data[Language.FI][course_dir] = {}
-        training_data[Language.EN][course_dir] = {}
+
+def get_course_dirs(courses_source_dir: str, course: Optional[str]) -> list[str]:
+    return [
+        course_dir
+        for course_dir in os.listdir(courses_source_dir)
+        if os.path.isdir(os.path.join(courses_source_dir, course_dir))
+        and (not course or course_dir == course)
+        and os.path.isdir(os.path.join(courses_source_dir, course_dir, "arvioinnit"))
+    ]
+
+
+def get_submissions(
+    courses_source_dir: str,
+    code_files_dir: str,
+    course_dirs: list[str],
+    archived_submissions: Optional[ArchivedSubmissions] = None,
+) -> Iterator[Submission]:
+    """Lists the graded submissions whose code files exist or are archived in
+    the order of the directory listings"""
+    for course_dir in course_dirs:
+        gradings_path = os.path.join(courses_source_dir, course_dir, "arvioinnit")
+        grading_instructions_path = os.path.join(gradings_path, "pohjat")
 
         for project in os.listdir(gradings_path):
             if not project.startswith("projekti"):
@@ -221,9 +345,6 @@ def get_training_data(
                     continue
 
                 for student_id in os.listdir(course_assistant_path):
-                    if max_entries and count >= max_entries:
-                        return training_data
-
                     destination_student_path = os.path.join(
                         code_files_dir,
                         course_dir,
@@ -232,51 +353,94 @@ def get_training_data(
                         student_id,
                     )
 
-                    if not os.path.isdir(destination_student_path):
-                        continue
-
-                    error = f"{course_dir}/{project}/{course_assistant}/{student_id}"
-                    feedback_raw = get_feedback_from_file(
-                        course_assistant_path, student_id
+                    archived = (
+                        archived_submissions.get((course_dir, project, student_id))
+                        if archived_submissions
+                        else None
                     )
-                    language = get_language(feedback_raw)
 
-                    if not language:
-                        raise Exception(f"Could not determine the language of {error}")
-                    elif target_language and language != target_language:
+                    if not archived and not os.path.isdir(destination_student_path):
                         continue
 
-                    feedback_template, grading_instructions = get_assessment_texts(
-                        grading_instructions_path, project, language
-                    )
+                    yield {
+                        "course": course_dir,
+                        "project": project,
+                        "course_assistant": course_assistant,
+                        "student_id": student_id,
+                        "feedback_path": os.path.join(
+                            course_assistant_path, student_id, "palaute.txt"
+                        ),
+                        "grading_instructions_path": grading_instructions_path,
+                        "destination_student_path": destination_student_path,
+                        "archived": archived,
+                    }
 
-                    if not feedback_template:
-                        raise Exception(f"Missing feedback_base of {error}")
-                    elif not grading_instructions:
-                        raise Exception(f"Missing grading_instructions of {error}")
 
-                    parsed_feedback = get_parsed_feedback(feedback_raw)
-                    anonymized_path = os.path.join(
-                        destination_student_path, "anonymized"
-                    )
-                    user_prompt = get_user_prompt(
-                        feedback_template,
-                        grading_instructions,
-                        anonymized_path,
-                    )
-                    count += 1
-                    data: TrainingDataEntry = {
-                        "source_code_path": anonymized_path,
-                        "user_prompt": user_prompt,
-                        "feedback": parsed_feedback,
-                    }
+def get_entry(
+    submission: Submission, target_language: Optional[Language] = None
+) -> tuple[Language, TrainingDataEntry] | None:
+    """Reads the feedback and the code files of the submission and assembles
+    its prompt. Returns None if the submission is not in the target language."""
+    error = (
+        f"{submission['course']}/{submission['project']}/"
+        f"{submission['course_assistant']}/{submission['student_id']}"
+    )
+    parsed_feedback = parse_feedback_file(submission["feedback_path"])
+    language = parsed_feedback["language"]
+
+    if not language:
+        raise Exception(f"Could not determine the language of {error}")
+    elif target_language and language != target_language:
+        return None
+
+    feedback_template, grading_instructions = get_assessment_texts(
+        submission["grading_instructions_path"], submission["project"], language
+    )
+
+    if not feedback_template:
+        raise Exception(f"Missing feedback_base of {error}")
+    elif not grading_instructions:
+        raise Exception(f"Missing grading_instructions of {error}")
+
+    archived = submission["archived"]
+
+    if archived:
+        source_code_path = archived["source_code_path"]
+        user_prompt = get_user_prompt_from_files(
+            feedback_template, grading_instructions, archived["source_files"]
+        )
+    else:
+        source_code_path = os.path.join(
+            submission["destination_student_path"], "anonymized"
+        )
+        user_prompt = get_user_prompt(
+            feedback_template, grading_instructions, source_code_path
+        )
+
+    return language, {
+        "source_code_path": source_code_path,
+        "course_assistant": submission["course_assistant"],
+        "user_prompt": user_prompt,
+        "feedback": parsed_feedback["feedback"],
+        "structured_feedback": parsed_feedback["structured_feedback"].to_dict(),
+    }
 
-                    if project in training_data[language][course_dir]:
-                        training_data[language][course_dir][project].append(data)
-                    else:
-                        training_data[language][course_dir][project] = [data]
 
-    return training_data
+def map_in_parallel(
+    function: Callable[[Submission, Optional[Language]], R],
+    submissions: Iterable[Submission],
+    target_language: Optional[Language],
+    workers: int,
+) -> Iterator[tuple[Submission, R]]:
+    """Applies the function to the submissions in a thread pool and yields the
+    results in the order of the submissions. The submissions are processed in
+    batches, so that stopping the iteration early skips the rest of them."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch in batched(submissions, workers * 4):
+            yield from zip(
+                batch,
+                executor.map(function, batch, [target_language] * len(batch)),
+            )
 
 
 def get_total_lines(lines: str) -> int:
@@ -285,10 +449,11 @@ def get_total_lines(lines: str) -> int:
 
 
 def get_formatted_training_data(
-    training_data: TrainingData, training_data_percentage: float
+    training_data: TrainingData,
+    training_data_percentage: float,
 ) -> tuple[str, str, Summary]:
-    training_partition = ""
-    validation_partition = ""
+    training_partitions: list[str] = []
+    validation_partitions: list[str] = []
     summary: Summary = {}
 
     for language, data_by_language in training_data.items():
@@ -301,29 +466,30 @@ def get_formatted_training_data(
                 training_partition_lang, validation_partition_lang = (
                     get_training_data_strings(data, training_data_percentage)
                 )
-                training_partition += training_partition_lang
-                validation_partition += validation_partition_lang
+                training_partitions.append(training_partition_lang)
+                validation_partitions.append(validation_partition_lang)
                 summary[language][course][project] = {
                     "training_entries": get_total_lines(training_partition_lang),
                     "validation_entries": get_total_lines(validation_partition_lang),
                 }
 
-    return training_partition, validation_partition, summary
+    return "".join(training_partitions), "".join(validation_partitions), summary
 
 
 def get_training_data_strings(
-    training_data: list[TrainingDataEntry], training_data_percentage: float
+    training_data: list[TrainingDataEntry],
+    training_data_percentage: float,
 ) -> tuple[str, str]:
-    training_partition = ""
-    validation_partition = ""
+    training_partition: list[str] = []
+    validation_partition: list[str] = []
     training_partition_size = int(len(training_data) * training_data_percentage)
 
     for count, data in enumerate(training_data):
         prompt = get_training_prompt(data["user_prompt"], data["feedback"])
 
         if count < training_partition_size:
-            training_partition += prompt
+            training_partition.append(prompt)
         else:
-            validation_partition += prompt
+            validation_partition.append(prompt)
 
-    return training_partition, validation_partition
+    return "".join(training_partition), "".join(validation_partition)
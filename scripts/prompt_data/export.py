@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+
+from queue import Queue
+from threading import Thread
+from typing import BinaryIO, Optional, TextIO
+from .constants import ENCODING, Language, Partition
+from .openai import get_training_prompt
+from .serialization import dumps
+from .tokens import count_entry_tokens
+from .types import MetainfoEntry, Shard, Summary, TrainingData, TrainingDataEntry
+
+
+def get_metainfo_file_path(path: str, metainfo_path: str) -> str:
+    """The path of the data file relative to the directory of the metainfo
+    file, so that the references do not depend on the working directory"""
+    path = os.path.abspath(path)
+
+    try:
+        return os.path.relpath(path, os.path.dirname(os.path.abspath(metainfo_path)))
+    except ValueError:
+        # On another drive on Windows
+        return path
+
+
+def resolve_metainfo_file_path(file: str, metainfo_path: str) -> str:
+    """The absolute path of the data file of a metainfo entry. Absolute paths
+    written by earlier versions are kept as they are."""
+    return os.path.abspath(
+        os.path.join(os.path.dirname(os.path.abspath(metainfo_path)), file)
+    )
+
+
+class PartitionWriter:
+    """Writes the prompts of a partition to a JSONL file and keeps track of
+    the byte offset of each written line. With `append`, the lines are
+    added after the existing ones."""
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self.file: BinaryIO = open(path, "ab" if append else "wb")
+        self.offset = self.file.tell()
+
+    def write(self, line: bytes, tokens: int = 0) -> tuple[str, int]:
+        """Returns the file and the offset the line was written at"""
+        offset = self.offset
+        self.file.write(line)
+        self.offset += len(line)
+
+        return self.path, offset
+
+    def close(self):
+        self.file.close()
+
+
+class ShardedPartitionWriter(PartitionWriter):
+    """Splits the partition into shards (<file>.0000.jsonl, <file>.0001.jsonl,
+    ...) of at most `max_bytes` bytes, `max_entries` entries and `max_tokens`
+    tokens. The lines are written and hashed in a background thread while the
+    data keeps streaming in."""
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+    ):
+        self.base_path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens
+        self.shards: list[Shard] = []
+        self.queue: Queue[tuple[str, bytes]] = Queue(maxsize=1024)
+        self.error: Optional[BaseException] = None
+        self.thread = Thread(target=self.write_shards, daemon=True)
+        self.thread.start()
+        # The first shard is created even if the partition stays empty, like
+        # the file of an unsharded partition
+        self.add_shard()
+
+    def get_shard_path(self, index: int) -> str:
+        root, extension = os.path.splitext(self.base_path)
+
+        return f"{root}.{index:04d}{extension}"
+
+    def is_full(self, shard: Shard, line: bytes, tokens: int) -> bool:
+        return shard["entries"] > 0 and bool(
+            (self.max_bytes and shard["bytes"] + len(line) > self.max_bytes)
+            or (self.max_entries and shard["entries"] >= self.max_entries)
+            or (self.max_tokens and shard["tokens"] + tokens > self.max_tokens)
+        )
+
+    def add_shard(self):
+        path = self.get_shard_path(len(self.shards))
+        self.shards.append(
+            {"path": path, "entries": 0, "bytes": 0, "tokens": 0, "sha256": ""}
+        )
+        self.queue.put((path, b""))
+
+    def write(self, line: bytes, tokens: int = 0) -> tuple[str, int]:
+        if self.error:
+            raise self.error
+
+        if self.is_full(self.shards[-1], line, tokens):
+            self.add_shard()
+
+        shard = self.shards[-1]
+        offset = shard["bytes"]
+        shard["entries"] += 1
+        shard["bytes"] += len(line)
+        shard["tokens"] += tokens
+        self.queue.put(("", line))
+
+        return shard["path"], offset
+
+    def write_shards(self):
+        file: Optional[BinaryIO] = None
+        checksum = hashlib.sha256()
+        checksums: list[str] = []
+
+        try:
+            while True:
+                path, line = self.queue.get()
+
+                if path or line is None:
+                    # A new shard or the end of the partition
+                    if file:
+                        file.close()
+                        checksums.append(checksum.hexdigest())
+
+                    if line is None:
+                        break
+
+                    file = open(path, "wb")
+                    checksum = hashlib.sha256()
+                elif file:
+                    file.write(line)
+                    checksum.update(line)
+        except BaseException as e:
+            self.error = e
+
+            # Keep consuming so that the producer is not blocked
+            while self.queue.get()[1] is not None:
+                pass
+        finally:
+            for shard, shard_checksum in zip(self.shards, checksums):
+                shard["sha256"] = shard_checksum
+
+    def close(self):
+        self.queue.put(("", None))  # type: ignore
+        self.thread.join()
+
+        if self.error:
+            raise self.error
+
+
+def write_manifest(path: str, writers: dict[Partition, PartitionWriter]):
+    """Writes the shards of each sharded partition with their checksums"""
+    with open(path, "w", encoding=ENCODING) as file:
+        json.dump(
+            {
+                partition: writer.shards
+                for partition, writer in writers.items()
+                if isinstance(writer, ShardedPartitionWriter)
+            },
+            file,
+            indent=2,
+        )
+
+
+def write_entry(
+    entry: TrainingDataEntry,
+    language: Language,
+    course: str,
+    project: str,
+    partition: Partition,
+    writer: PartitionWriter,
+    metainfo_file: TextIO,
+):
+    line = get_training_prompt(entry["user_prompt"], entry["feedback"]).encode(ENCODING)
+    tokens = count_entry_tokens(entry)
+    file, offset = writer.write(line, tokens)
+    metainfo: MetainfoEntry = {
+        "source_code_path": entry["source_code_path"],
+        "language": language,
+        "course": course,
+        "project": project,
+        "partition": partition,
+        "file": get_metainfo_file_path(file, metainfo_file.name),
+        "offset": offset,
+        "length": len(line),
+        "sha256": hashlib.sha256(line).hexdigest(),
+        "tokens": tokens,
+        # Only the points, the feedback itself is in the referenced line
+        "points": entry["structured_feedback"]["points"],
+    }
+    metainfo_file.write(dumps(metainfo) + "\n")
+
+
+def write_training_files(
+    training_data: TrainingData,
+    training_data_percentage: float,
+    writers: dict[Partition, PartitionWriter],
+    metainfo_path: str,
+) -> Summary:
+    """Writes the training and validation partitions and a metainfo JSONL file
+    which references each prompt by its partition, file, byte offset and length
+    instead of repeating it"""
+    summary: Summary = {}
+
+    with open(metainfo_path, "w", encoding=ENCODING) as metainfo_file:
+        for language, data_by_language in training_data.items():
+            summary[language] = {}
+
+            for course, data_by_course in data_by_language.items():
+                summary[language][course] = {}
+
+                for project, data in data_by_course.items():
+                    training_partition_size = int(len(data) * training_data_percentage)
+
+                    for count, entry in enumerate(data):
+                        partition = (
+                            Partition.Training
+                            if count < training_partition_size
+                            else Partition.Validation
+                        )
+                        write_entry(
+                            entry,
+                            language,
+                            course,
+                            project,
+                            partition,
+                            writers[partition],
+                            metainfo_file,
+                        )
+
+                    summary[language][course][project] = {
+                        "training_entries": training_partition_size,
+                        "validation_entries": len(data) - training_partition_size,
+                    }
+
+    return summary
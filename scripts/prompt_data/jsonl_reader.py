@@ -0,0 +1,146 @@
+import json
+import mmap
+import os
+import random
+
+from array import array
+from typing import Any, Iterator, Optional
+from .constants import ENCODING
+from .export import resolve_metainfo_file_path
+from .types import MetainfoEntry
+
+INDEX_SUFFIX = ".idx"
+
+
+class JsonlReader:
+    """Random access to the entries of a training or validation JSONL file.
+
+    The file is memory-mapped and the byte offsets of its lines are kept in a
+    sidecar index file (<file>.idx), which is rebuilt when it is older than
+    the JSONL file. With a metainfo file, the entries can also be filtered by
+    language, course and project.
+
+    Usage:
+    with JsonlReader("training.jsonl", "metainfo.jsonl") as reader:
+        entry = reader[10]
+    """
+
+    def __init__(self, path: str, metainfo_path: Optional[str] = None):
+        self.path = path
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.mmap = (
+            mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.size
+            else None
+        )
+        self.offsets = self.load_index()
+        self.metainfo = self.load_metainfo(metainfo_path) if metainfo_path else None
+
+    def __enter__(self) -> "JsonlReader":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        if self.mmap:
+            self.mmap.close()
+
+        self.file.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> dict[str, Any]:
+        return json.loads(self.get_line(index))
+
+    def get_line(self, index: int) -> bytes:
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self) or not self.mmap:
+            raise IndexError(f"Entry {index} out of range")
+
+        return self.mmap[self.offsets[index] : self.offsets[index + 1]]
+
+    def load_index(self) -> array:
+        index_path = self.path + INDEX_SUFFIX
+        offsets = array("Q")
+
+        if os.path.isfile(index_path) and os.path.getmtime(
+            index_path
+        ) >= os.path.getmtime(self.path):
+            with open(index_path, "rb") as file:
+                offsets.frombytes(file.read())
+
+            if offsets and offsets[-1] == self.size:
+                return offsets
+
+            offsets = array("Q")
+
+        offsets.append(0)
+
+        if self.mmap:
+            position = self.mmap.find(b"\n")
+
+            while position != -1:
+                offsets.append(position + 1)
+                position = self.mmap.find(b"\n", position + 1)
+
+            if offsets[-1] != self.size:
+                # The last line has no trailing newline
+                offsets.append(self.size)
+
+        with open(index_path, "wb") as file:
+            file.write(offsets.tobytes())
+
+        return offsets
+
+    def load_metainfo(self, metainfo_path: str) -> dict[int, MetainfoEntry]:
+        """Maps the line indices of this file to their metainfo entries"""
+        line_indices = {offset: i for i, offset in enumerate(self.offsets[:-1])}
+        metainfo: dict[int, MetainfoEntry] = {}
+        path = os.path.abspath(self.path)
+
+        with open(metainfo_path, "r", encoding=ENCODING) as file:
+            for line in file:
+                entry: MetainfoEntry = json.loads(line)
+
+                if resolve_metainfo_file_path(entry["file"], metainfo_path) != path:
+                    continue
+
+                if entry["offset"] in line_indices:
+                    metainfo[line_indices[entry["offset"]]] = entry
+
+        return metainfo
+
+    def sample(
+        self, count: int, seed: Optional[int] = None
+    ) -> list[tuple[int, dict[str, Any]]]:
+        indices = random.Random(seed).sample(range(len(self)), min(count, len(self)))
+
+        return [(index, self[index]) for index in indices]
+
+    def filter(
+        self,
+        language: Optional[str] = None,
+        course: Optional[str] = None,
+        project: Optional[str] = None,
+    ) -> Iterator[tuple[int, dict[str, Any]]]:
+        """Yields the indices and entries matching the metainfo filters"""
+        if self.metainfo is None:
+            raise ValueError("Filtering requires a metainfo file")
+
+        for index in range(len(self)):
+            entry = self.metainfo.get(index)
+
+            if (
+                not entry
+                or (language and entry["language"] != language)
+                or (course and entry["course"] != course)
+                or (project and entry["project"] != project)
+            ):
+                continue
+
+            yield index, self[index]
@@ -1,3 +1,3 @@
-from .openai import Role, get_training_prompt
+from .openai import Message, Role, get_messages, get_training_prompt
 
-__all__ = ("Role", "get_training_prompt")
+__all__ = ("Message", "Role", "get_messages", "get_training_prompt")
@@ -1,6 +1,6 @@
-import json
 from enum import StrEnum
 from ..constants import SYSTEM_MESSAGE_CONTENT
+from ..serialization import dumps
 from ..types import Language
 from typing import TypedDict
 
@@ -31,17 +31,25 @@ def get_message(role: Role, content: str) -> Message:
     }
 
 
+def get_messages(user_prompt: str) -> list[Message]:
+    """Returns the system and user messages of the prompt. The prompts of the
+    students of a project are byte-identical up to the first code file, which
+    the provider can cache."""
+    return [
+        get_message(Role.System, SYSTEM_MESSAGE_CONTENT),
+        get_message(Role.User, user_prompt),
+    ]
+
+
+SYSTEM_MESSAGE_JSON = dumps(get_message(Role.System, SYSTEM_MESSAGE_CONTENT))
+
+
 def get_training_prompt(user_prompt: str, parsed_feedback: str) -> str:
-    return (
-        json.dumps(
-            {
-                "messages": [
-                    get_message(Role.System, SYSTEM_MESSAGE_CONTENT),
-                    get_message(Role.User, user_prompt),
-                    get_message(Role.Assistant, parsed_feedback),
-                ]
-            },
-            ensure_ascii=False,
-        )
-        + "\n"
-    )
+    # The system message is the same in every entry, so it is encoded once
+    messages = [SYSTEM_MESSAGE_JSON] + [
+        dumps(message)
+        for message in get_messages(user_prompt)[1:]
+        + [get_message(Role.Assistant, parsed_feedback)]
+    ]
+
+    return f'{{"messages":[{",".join(messages)}]}}\n'
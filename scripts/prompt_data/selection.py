@@ -0,0 +1,203 @@
+import heapq
+import random
+import re
+import zlib
+
+from collections import Counter
+from typing import Optional, TypedDict
+from submission_data import get_points_from_feedback
+from .constants import DENOTIONS, Language
+from .tokens import count_entry_tokens
+from .types import TrainingData, TrainingDataEntry
+
+SKETCH_SIZE = 128
+SHINGLE_LENGTH = 5
+CODE_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+class Candidate(TypedDict):
+    language: Language
+    course: str
+    project: str
+    index: int
+    tokens: int
+    features: list[tuple[str, ...]]
+    sketch: list[int]
+
+
+class Selection(TypedDict):
+    training_data: TrainingData
+    entries: int
+    tokens: int
+    coverage: dict[str, tuple[int, int]]
+
+
+def get_features(
+    language: Language, course: str, project: str, entry: TrainingDataEntry
+) -> list[tuple[str, ...]]:
+    """The values whose coverage the selection maximizes"""
+    points = get_points_from_feedback(entry["feedback"])
+
+    return [
+        ("language", language),
+        ("course", course),
+        ("project", course, project),
+        ("grader", course, entry["course_assistant"]),
+        ("overall_solution", points["overall_solution"] or "missing"),
+        ("style", points["style"] or "missing"),
+    ]
+
+
+def get_code_sketch(user_prompt: str) -> list[int]:
+    """Bottom-k sketch of the hashed token shingles of the code files, which
+    estimates the Jaccard similarity of two submissions"""
+    code_start = user_prompt.find(DENOTIONS["file"])
+    tokens = CODE_TOKEN_PATTERN.findall(user_prompt[max(code_start, 0) :])
+    shingles = {
+        zlib.crc32(" ".join(tokens[i : i + SHINGLE_LENGTH]).encode())
+        for i in range(max(len(tokens) - SHINGLE_LENGTH + 1, 1))
+    }
+
+    return sorted(heapq.nsmallest(SKETCH_SIZE, shingles))
+
+
+def get_similarity(sketch: list[int], other_sketch: list[int]) -> float:
+    union = heapq.nsmallest(SKETCH_SIZE, set(sketch) | set(other_sketch))
+
+    if not union:
+        return 0
+
+    common = set(sketch) & set(other_sketch)
+
+    return sum(value in common for value in union) / len(union)
+
+
+def select_training_data(
+    training_data: TrainingData,
+    token_budget: int,
+    diversity: bool = False,
+    seed: Optional[int] = None,
+) -> Selection:
+    """Selects entries within the token budget so that the languages,
+    courses, projects, graders and the overall solution and style points are
+    covered as evenly as possible.
+
+    The entries are picked greedily by their marginal gain: each feature
+    value contributes 1 / (1 + the number of selected entries having it).
+    With `diversity`, the gain is also scaled down by the code similarity to
+    the most similar entry already selected from the same project. The gains
+    only decrease as the selection grows, so they are re-evaluated lazily.
+    The selected entries keep their order in the training data."""
+    candidates: list[Candidate] = []
+
+    for language, data_by_language in training_data.items():
+        for course, data_by_course in data_by_language.items():
+            for project, data in data_by_course.items():
+                for index, entry in enumerate(data):
+                    candidates.append(
+                        {
+                            "language": language,
+                            "course": course,
+                            "project": project,
+                            "index": index,
+                            "tokens": count_entry_tokens(entry),
+                            "features": get_features(language, course, project, entry),
+                            "sketch": (
+                                get_code_sketch(entry["user_prompt"])
+                                if diversity
+                                else []
+                            ),
+                        }
+                    )
+
+    selected_features: Counter[tuple[str, ...]] = Counter()
+    selected_sketches: dict[tuple[str, str], list[list[int]]] = {}
+
+    def get_gain(candidate: Candidate) -> float:
+        gain = sum(
+            1 / (1 + selected_features[feature]) for feature in candidate["features"]
+        )
+
+        if diversity:
+            gain *= 1 - max(
+                (
+                    get_similarity(candidate["sketch"], sketch)
+                    for sketch in selected_sketches.get(
+                        (candidate["course"], candidate["project"]), []
+                    )
+                ),
+                default=0,
+            )
+
+        return gain
+
+    # Ties are broken randomly, not by the directory order
+    tiebreakers = list(range(len(candidates)))
+    random.Random(seed).shuffle(tiebreakers)
+    heap = [
+        (-get_gain(candidate), tiebreakers[i], i)
+        for i, candidate in enumerate(candidates)
+    ]
+    heapq.heapify(heap)
+    remaining = token_budget
+    selected: set[tuple[Language, str, str, int]] = set()
+
+    while heap:
+        _, tiebreaker, i = heapq.heappop(heap)
+        candidate = candidates[i]
+
+        if candidate["tokens"] > remaining:
+            continue
+
+        gain = get_gain(candidate)
+
+        if heap and gain < -heap[0][0]:
+            heapq.heappush(heap, (-gain, tiebreaker, i))
+            continue
+
+        remaining -= candidate["tokens"]
+        selected_features.update(candidate["features"])
+        selected_sketches.setdefault(
+            (candidate["course"], candidate["project"]), []
+        ).append(candidate["sketch"])
+        selected.add(
+            (
+                candidate["language"],
+                candidate["course"],
+                candidate["project"],
+                candidate["index"],
+            )
+        )
+
+    selected_training_data: TrainingData = {}
+
+    for language, data_by_language in training_data.items():
+        for course, data_by_course in data_by_language.items():
+            for project, data in data_by_course.items():
+                entries = [
+                    entry
+                    for index, entry in enumerate(data)
+                    if (language, course, project, index) in selected
+                ]
+
+                if entries:
+                    selected_training_data.setdefault(language, {}).setdefault(
+                        course, {}
+                    )[project] = entries
+
+    all_features = {
+        feature for candidate in candidates for feature in candidate["features"]
+    }
+
+    return {
+        "training_data": selected_training_data,
+        "entries": len(selected),
+        "tokens": token_budget - remaining,
+        "coverage": {
+            kind: (
+                len({feature for feature in selected_features if feature[0] == kind}),
+                len({feature for feature in all_features if feature[0] == kind}),
+            )
+            for kind in dict.fromkeys(feature[0] for feature in all_features)
+        },
+    }
@@ -0,0 +1,17 @@
+import json
+
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data: Any) -> str:
+    """Serializes the data as compact JSON, with orjson if it is installed.
+    Both encoders produce the same output."""
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,43 @@
+from functools import lru_cache
+from .constants import SYSTEM_MESSAGE_CONTENT
+from .types import TrainingDataEntry
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+TOKENIZER_ENCODING = "o200k_base"
+# Rough average for mixed C++ and Finnish/English text
+CHARACTERS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    return tiktoken.get_encoding(TOKENIZER_ENCODING) if tiktoken else None
+
+
+def count_tokens(text: str) -> int:
+    """Counts the tokens with tiktoken if it is installed, otherwise estimates
+    the count from the length of the text"""
+    encoding = get_encoding()
+
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    return -(-len(text) // CHARACTERS_PER_TOKEN)
+
+
+@lru_cache(maxsize=1)
+def get_system_message_tokens() -> int:
+    return count_tokens(SYSTEM_MESSAGE_CONTENT)
+
+
+def count_entry_tokens(entry: TrainingDataEntry) -> int:
+    """Tokens of the system message, the prompt and the feedback of a
+    training example"""
+    return (
+        get_system_message_tokens()
+        + count_tokens(entry["user_prompt"])
+        + count_tokens(entry["feedback"])
+    )
@@ -1,16 +1,67 @@
-from typing import TypedDict
-from .constants import Language
+from typing import Any, TypedDict
+from submission_data import Points, StructuredFeedback
+from .constants import Language, Partition
 
 
 class TrainingDataEntry(TypedDict):
     source_code_path: str
+    course_assistant: str
     user_prompt: str
     feedback: str
+    structured_feedback: dict[str, Any]
+
+
+class ParsedFeedback(TypedDict):
+    language: Language | None
+    feedback: str
+    structured_feedback: StructuredFeedback
+
+
+class ArchivedSubmission(TypedDict):
+    source_code_path: str
+    source_files: list[tuple[str, str]]
+
+
+# By the course, the project and the student ID
+ArchivedSubmissions = dict[tuple[str, str, str], ArchivedSubmission]
+
+
+class Submission(TypedDict):
+    course: str
+    project: str
+    course_assistant: str
+    student_id: str
+    feedback_path: str
+    grading_instructions_path: str
+    destination_student_path: str
+    archived: ArchivedSubmission | None
 
 
 TrainingData = dict[Language, dict[str, dict[str, list[TrainingDataEntry]]]]
 
 
+class MetainfoEntry(TypedDict):
+    source_code_path: str
+    language: Language
+    course: str
+    project: str
+    partition: Partition
+    file: str
+    offset: int
+    length: int
+    sha256: str
+    tokens: int
+    points: Points
+
+
+class Shard(TypedDict):
+    path: str
+    entries: int
+    bytes: int
+    tokens: int
+    sha256: str
+
+
 class LogEntry(TypedDict):
     training_entries: int
     validation_entries: int
@@ -1,67 +1,210 @@
+"""Deletes the repositories of students who have not given their consent
+
+The consent index (TUNI username -> student ID & consent status) is built once
+from the consent and students files and persisted, so that it can be reused
+for any number of project directories.
+
+Usage:
+python remove_non_consent_repos.py <projectdir> [<projectdir> ...] <consentfile> <studentsfile>
+
+Example:
+python remove_non_consent_repos.py C:/courses/2023_autumn/student_repositories/project_1 C:/courses/2023_autumn/student_repositories/project_2 consents.json students.json --dry-run
+"""
+
 import argparse
+import hashlib
 import json
 import os
 import shutil
 
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Literal, Optional, TypedDict
 from utils import on_rm_error
 
 
-def delete_directories(project_dir: str, consent_file: str, students_file: str):
+class ConsentEntry(TypedDict):
+    student_id: str
+    has_given_consent: bool
+
+
+ConsentIndex = dict[str, ConsentEntry]
+
+
+class ConsentIndexFile(TypedDict):
+    sources: dict[str, str]
+    consents: ConsentIndex
+
+
+class AuditLogEntry(TypedDict):
+    timestamp: str
+    path: str
+    student_id: Optional[str]
+    reason: str
+    action: Literal["deleted", "dry_run", "missing"]
+
+
+def build_consent_index(consent_file: str, students_file: str) -> ConsentIndex:
     with open(students_file, "r", encoding="utf-8") as file:
         usernames = {
             student["student_id"]: student["username"].split("@")[0]
             for student in json.load(file)
         }
 
+    consents: ConsentIndex = {}
+
     with open(consent_file, "r") as file:
-        consents = {
-            usernames[consent["StudentID"]]: {
-                "student_id": consent["StudentID"],
+        for consent in json.load(file):
+            student_id = consent["StudentID"]
+
+            if student_id not in usernames:
+                print(f"No student found for the consent of student ID: {student_id}")
+                continue
+
+            consents[usernames[student_id]] = {
+                "student_id": student_id,
                 "has_given_consent": consent["field_0"] == "a",
             }
-            for consent in json.load(file)
-        }
 
-    count = 0
+    return consents
+
+
+def get_consent_index_sources(consent_file: str, students_file: str) -> dict[str, str]:
+    """Returns the SHA-256 checksums of the consent and students files by their
+    absolute paths"""
+    sources: dict[str, str] = {}
+
+    for path in (consent_file, students_file):
+        with open(path, "rb") as file:
+            sources[os.path.abspath(path)] = hashlib.sha256(file.read()).hexdigest()
+
+    return sources
 
-    def delete_directory(student_id: Optional[str] = None):
-        dir_path = os.path.join(project_dir, repository)
 
-        if os.path.isdir(dir_path):
-            print(f"Deleting directory: {dir_path} Student ID: {student_id}")
-            shutil.rmtree(dir_path, onexc=on_rm_error)  # type: ignore
+def get_consent_index(
+    consent_file: str, students_file: str, index_file: Optional[str] = None
+) -> ConsentIndex:
+    """Loads the persisted consent index if it was built from the same consent
+    and students files with the same contents, otherwise builds it and persists
+    it to `index_file` with the checksums of its sources"""
+    sources = get_consent_index_sources(consent_file, students_file)
 
-            nonlocal count
-            count += 1
-        else:
-            print(f"Directory does not exist or is not a directory: {dir_path}")
+    if index_file and os.path.isfile(index_file):
+        with open(index_file, "r", encoding="utf-8") as file:
+            persisted: ConsentIndexFile = json.load(file)
+
+        if isinstance(persisted, dict) and persisted.get("sources") == sources:
+            return persisted["consents"]
+
+        print(f"Rebuilding the consent index {index_file}")
+
+    consents = build_consent_index(consent_file, students_file)
+
+    if index_file:
+        with open(index_file, "w", encoding="utf-8") as file:
+            json.dump(
+                {"sources": sources, "consents": consents}, file, ensure_ascii=False
+            )
+
+    return consents
+
+
+def get_directories_to_delete(
+    project_dir: str, consents: ConsentIndex
+) -> list[tuple[str, Optional[str], str]]:
+    directories: list[tuple[str, Optional[str], str]] = []
 
     for repository in os.listdir(project_dir):
+        dir_path = os.path.join(project_dir, repository)
+
         if repository not in consents:
-            delete_directory()
+            directories.append((dir_path, None, "no consent entry"))
             continue
 
         consent = consents[repository]
 
-        if consent["has_given_consent"]:
-            continue
+        if not consent["has_given_consent"]:
+            directories.append((dir_path, consent["student_id"], "consent not given"))
+
+    return directories
+
+
+def delete_directory(
+    dir_path: str, student_id: Optional[str], reason: str, dry_run: bool
+) -> AuditLogEntry:
+    action: Literal["deleted", "dry_run", "missing"]
+
+    if not os.path.isdir(dir_path):
+        print(f"Directory does not exist or is not a directory: {dir_path}")
+        action = "missing"
+    elif dry_run:
+        print(f"Would delete directory: {dir_path} Student ID: {student_id}")
+        action = "dry_run"
+    else:
+        print(f"Deleting directory: {dir_path} Student ID: {student_id}")
+        shutil.rmtree(dir_path, onexc=on_rm_error)  # type: ignore
+        action = "deleted"
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "path": dir_path,
+        "student_id": student_id,
+        "reason": reason,
+        "action": action,
+    }
+
+
+def delete_directories(
+    project_dirs: list[str],
+    consents: ConsentIndex,
+    dry_run: bool = False,
+    workers: Optional[int] = None,
+) -> list[AuditLogEntry]:
+    directories = [
+        directory
+        for project_dir in project_dirs
+        for directory in get_directories_to_delete(project_dir, consents)
+    ]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        audit_log = list(
+            executor.map(
+                lambda directory: delete_directory(*directory, dry_run), directories
+            )
+        )
+
+    count = sum(entry["action"] != "missing" for entry in audit_log)
+
+    print(f"{'Would delete' if dry_run else 'Deleted'} {count} directories")
+
+    return audit_log
 
-        delete_directory(consent["student_id"])
 
-    print(f"Deleted {count} directories")
+def write_audit_log(audit_log_file: str, audit_log: list[AuditLogEntry]):
+    with open(audit_log_file, "a", encoding="utf-8") as file:
+        for entry in audit_log:
+            file.write(json.dumps(entry, ensure_ascii=False) + "\n")
 
 
 def main():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("projectdir")
+    parser.add_argument("projectdirs", nargs="+")
     parser.add_argument("consentfile")
     parser.add_argument("studentsfile")
+    parser.add_argument("--index-file")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--audit-log")
 
     args = parser.parse_args()
+    consents = get_consent_index(args.consentfile, args.studentsfile, args.index_file)
+    audit_log = delete_directories(
+        args.projectdirs, consents, dry_run=args.dry_run, workers=args.workers
+    )
 
-    delete_directories(args.projectdir, args.consentfile, args.studentsfile)
+    if args.audit_log:
+        write_audit_log(args.audit_log, audit_log)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+import io
+import os
+import tarfile
+import xml.etree.ElementTree as ElementTree
+import zipfile
+
+from functools import partial
+from pathlib import PurePosixPath
+from typing import IO, Callable, Iterator, Optional
+from anonymize_cpp_files import anonymize_source
+from clean_repositories import ALLOWED_EXTENSIONS, STUDENT_DIR, is_deleted_directory
+from cpp_normalizer import NormalizationOptions
+from prompt_data import ENCODING
+from prompt_data.types import ArchivedSubmission
+from remove_non_consent_repos import ConsentIndex
+from ui_summarizer import summarize_ui
+
+
+def get_archive_files(
+    archive_path: str,
+) -> Iterator[tuple[str, Callable[[], Optional[IO[bytes]]]]]:
+    """Yields the names of the files in a zip or tar archive with a function
+    opening the file. A tar archive is read as a stream, so a file has to be
+    opened before moving to the next one."""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield info.filename, partial(archive.open, info)
+    else:
+        with tarfile.open(archive_path, "r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, partial(archive.extractfile, member)
+
+
+def get_kept_file(
+    name: str,
+    project_round_dir: str,
+    project_assignment_dir: str,
+    unknown_dirs: set[str],
+) -> Optional[tuple[str, str, str]]:
+    """Returns the student ID, the assignment directory path in the archive and
+    the file name if clean_repositories.py would keep the file in the src
+    directory of the student. The directories whose names are not known to be
+    deleted are added to `unknown_dirs` for manual inspection, like in
+    clean_repositories.py."""
+    parts = PurePosixPath(name.replace("\\", "/")).parts
+
+    if STUDENT_DIR not in parts[1:]:
+        return None
+
+    student_index = parts.index(STUDENT_DIR, 1)
+    assignment_parts = parts[: student_index + 3]
+    file_parts = parts[student_index + 3 :]
+
+    if assignment_parts[student_index + 1 :] != (
+        project_round_dir,
+        project_assignment_dir,
+    ):
+        return None
+
+    if len(file_parts) > 1:
+        # Only the files directly in the src directory are anonymized
+        if not is_deleted_directory(file_parts[0].lower()):
+            unknown_dirs.add("/".join(assignment_parts + file_parts[:1]))
+
+        return None
+
+    if not file_parts or not file_parts[0].endswith(ALLOWED_EXTENSIONS):
+        return None
+
+    return parts[student_index - 1], "/".join(assignment_parts), file_parts[0]
+
+
+def anonymize_archived_file(
+    file_name: str,
+    content: bytes,
+    options: Optional[NormalizationOptions] = None,
+    summarize_ui_files: bool = False,
+) -> Optional[str]:
+    """Anonymizes the file like anonymize_cpp_files.py but in memory. Returns
+    None if the file would not be in the anonymized directory."""
+    if file_name.endswith(".ui"):
+        if not summarize_ui_files:
+            return None
+
+        try:
+            return summarize_ui(io.BytesIO(content))
+        except ElementTree.ParseError as e:
+            print(f"Skipping {file_name}: {e}")
+            return None
+
+    if not file_name.endswith((".cpp", ".hh")):
+        return None
+
+    source_code, _, _ = anonymize_source(
+        file_name, content.decode(ENCODING, errors="replace"), options
+    )
+
+    return source_code
+
+
+def read_archived_submissions(
+    archive_path: str,
+    project_round_dir: str,
+    project_assignment_dir: str,
+    consents: ConsentIndex,
+    options: Optional[NormalizationOptions] = None,
+    summarize_ui_files: bool = False,
+) -> dict[str, ArchivedSubmission]:
+    """Reads the anonymized code files of each student from a zip or tar
+    archive of the repositories of a project without extracting it. The
+    archive has the directory structure expected by clean_repositories.py,
+    optionally inside a top-level directory. The repositories of the students
+    who have not given their consent are skipped like in
+    remove_non_consent_repos.py, and only the kept files are read and
+    decompressed. Returns the submissions by the student ID."""
+    submissions: dict[str, ArchivedSubmission] = {}
+    source_files: dict[str, dict[str, str]] = {}
+    unknown_dirs: set[str] = set()
+    non_consent_students: set[str] = set()
+
+    for name, open_file in get_archive_files(archive_path):
+        kept_file = get_kept_file(
+            name, project_round_dir, project_assignment_dir, unknown_dirs
+        )
+
+        if not kept_file:
+            continue
+
+        student_id, assignment_path, file_name = kept_file
+
+        if student_id not in consents or not consents[student_id]["has_given_consent"]:
+            non_consent_students.add(student_id)
+            continue
+
+        file = open_file()
+
+        if not file:
+            continue
+
+        with file:
+            source_code = anonymize_archived_file(
+                file_name, file.read(), options, summarize_ui_files
+            )
+
+        if student_id not in submissions:
+            submissions[student_id] = {
+                "source_code_path": os.path.join(archive_path, assignment_path),
+                "source_files": [],
+            }
+            source_files[student_id] = {}
+
+        if source_code is not None:
+            source_files[student_id][file_name] = source_code
+
+    for unknown_dir in sorted(unknown_dirs):
+        print(os.path.join(archive_path, unknown_dir))
+
+    if non_consent_students:
+        print(
+            f"Skipped {len(non_consent_students)} repositories without consent in "
+            f"{archive_path}"
+        )
+
+    for student_id, submission in submissions.items():
+        submission["source_files"] = sorted(source_files[student_id].items())
+
+    return submissions
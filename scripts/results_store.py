@@ -0,0 +1,216 @@
+"""SQLite store for the grading results of compare_feedbacks.py
+
+The gradings are stored one row per (run, iteration, model, submission).
+Prompts and feedback messages are stored once by their hash, so repeated
+iterations over the same submissions only add the AI feedback and points.
+The token usage and telemetry of each request sent are stored in a separate
+table. The submissions skipped in an iteration of the adaptive mode have
+"skipped" as their AI points.
+"""
+
+import hashlib
+import sqlite3
+
+from datetime import datetime
+from typing import Literal, Optional, TypedDict
+
+RESULTS_STORE_FILENAME = "results.sqlite3"
+# The AI points of a submission not graded in an iteration of the adaptive
+# mode, as opposed to empty points which could not be parsed
+SKIPPED_POINTS = "skipped"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS contents (
+    hash TEXT PRIMARY KEY,
+    content TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS gradings (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    iteration INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    submission TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL REFERENCES contents (hash),
+    ai_message TEXT NOT NULL,
+    ai_overall_solution TEXT NOT NULL,
+    ai_style TEXT NOT NULL,
+    actual_message_hash TEXT NOT NULL REFERENCES contents (hash),
+    actual_overall_solution TEXT NOT NULL,
+    actual_style TEXT NOT NULL,
+    PRIMARY KEY (run_id, iteration, model, submission)
+);
+CREATE TABLE IF NOT EXISTS requests (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    iteration INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    submission TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    time_to_first_token REAL,
+    latency REAL NOT NULL,
+    tokens_per_second REAL NOT NULL,
+    retries INTEGER NOT NULL,
+    PRIMARY KEY (run_id, iteration, model, submission)
+);
+"""
+
+
+class GradingRow(TypedDict):
+    source_code_path: str
+    user_prompt: str
+    ai_message: str
+    ai_overall_solution: str
+    ai_style: str
+    actual_message: str
+    actual_overall_solution: str
+    actual_style: str
+
+
+class RequestRow(TypedDict):
+    source_code_path: str
+    prompt_tokens: int
+    cached_tokens: int
+    completion_tokens: int
+    time_to_first_token: Optional[float]
+    latency: float
+    tokens_per_second: float
+    retries: int
+
+
+def get_content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.executescript(SCHEMA)
+
+    return connection
+
+
+def create_run(connection: sqlite3.Connection) -> int:
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO runs (created_at) VALUES (?)",
+            (datetime.now().strftime("%Y%m%d_%H%M%S"),),
+        )
+
+    return int(cursor.lastrowid or 0)
+
+
+def save_gradings(
+    connection: sqlite3.Connection,
+    run_id: int,
+    iteration: int,
+    model: str,
+    rows: list[GradingRow],
+):
+    contents: dict[str, str] = {}
+    gradings = []
+
+    for row in rows:
+        prompt_hash = get_content_hash(row["user_prompt"])
+        actual_message_hash = get_content_hash(row["actual_message"])
+        contents[prompt_hash] = row["user_prompt"]
+        contents[actual_message_hash] = row["actual_message"]
+        gradings.append(
+            (
+                run_id,
+                iteration,
+                model,
+                row["source_code_path"],
+                prompt_hash,
+                row["ai_message"],
+                row["ai_overall_solution"],
+                row["ai_style"],
+                actual_message_hash,
+                row["actual_overall_solution"],
+                row["actual_style"],
+            )
+        )
+
+    with connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO contents (hash, content) VALUES (?, ?)",
+            contents.items(),
+        )
+        connection.executemany(
+            "INSERT OR REPLACE INTO gradings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            gradings,
+        )
+
+
+def save_requests(
+    connection: sqlite3.Connection,
+    run_id: int,
+    iteration: int,
+    model: str,
+    rows: list[RequestRow],
+):
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO requests "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    run_id,
+                    iteration,
+                    model,
+                    row["source_code_path"],
+                    row["prompt_tokens"],
+                    row["cached_tokens"],
+                    row["completion_tokens"],
+                    row["time_to_first_token"],
+                    row["latency"],
+                    row["tokens_per_second"],
+                    row["retries"],
+                )
+                for row in rows
+            ),
+        )
+
+
+def get_points_columns(
+    connection: sqlite3.Connection,
+    key: Literal["overall_solution"] | Literal["style"],
+) -> tuple[list[str], list[tuple[str, ...]], tuple[str, ...]]:
+    """Returns the labels and AI points of each (run, iteration, model) and
+    the actual points, aligned by the submission. The submissions are in the
+    order they were first stored, and the points of a submission missing from
+    a (run, iteration, model) are empty."""
+    actual_points_by_submission: dict[str, str] = dict(
+        connection.execute(
+            f"SELECT g.submission, g.actual_{key} FROM gradings g "
+            "WHERE g.rowid IN "
+            "(SELECT MIN(rowid) FROM gradings GROUP BY submission) "
+            "ORDER BY g.rowid"
+        ).fetchall()
+    )
+    labels: list[str] = []
+    ai_points: list[tuple[str, ...]] = []
+
+    for run_id, created_at, iteration, model in connection.execute(
+        "SELECT DISTINCT g.run_id, r.created_at, g.iteration, g.model "
+        "FROM gradings g JOIN runs r USING (run_id) "
+        "ORDER BY g.run_id, g.iteration, g.model"
+    ).fetchall():
+        ai_points_by_submission: dict[str, str] = dict(
+            connection.execute(
+                f"SELECT submission, ai_{key} FROM gradings "
+                "WHERE run_id = ? AND iteration = ? AND model = ?",
+                (run_id, iteration, model),
+            ).fetchall()
+        )
+        labels.append(f"{created_at}/{iteration}/{model}")
+        ai_points.append(
+            tuple(
+                ai_points_by_submission.get(submission, "")
+                for submission in actual_points_by_submission
+            )
+        )
+
+    return labels, ai_points, tuple(actual_points_by_submission.values())
@@ -0,0 +1,201 @@
+"""Uploads the fine-tuning data, starts the fine-tuning job and waits for it
+to finish
+
+The job and the resulting model are written to a run manifest, which can be
+passed to compare_feedbacks.py with --run-manifest. Running the script again
+with an existing manifest of an unfinished job resumes polling that job. A
+succeeded job is not started again, only a failed or cancelled one, unless
+--force is given.
+
+Usage:
+python run_fine_tuning.py <api_key> <training_file> <validation_file> <run_manifest_file> [--model <base model>] [--force]
+
+Example:
+python run_fine_tuning.py sk-... training.jsonl validation.jsonl run.json --suffix grader --base-url http://localhost:8000/v1
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import sleep
+from typing import Callable, Optional, TypedDict
+from openai import (
+    NOT_GIVEN,
+    AuthenticationError,
+    BadRequestError,
+    NotFoundError,
+    OpenAI,
+    PermissionDeniedError,
+)
+from openai.types.fine_tuning import FineTuningJob
+
+DEFAULT_MODEL = "gpt-4o-mini-2024-07-18"
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+MAX_POLL_RETRIES = 10
+# Errors which sending the same request again does not fix, e.g. an invalid
+# API key, an unknown model or an unknown job
+NON_RETRYABLE_ERRORS = (
+    AuthenticationError,
+    BadRequestError,
+    NotFoundError,
+    PermissionDeniedError,
+)
+
+
+class RunManifest(TypedDict):
+    job_id: str
+    status: str
+    model: str
+    fine_tuned_model: Optional[str]
+    training_file: str
+    validation_file: str
+    training_file_id: str
+    validation_file_id: str
+    updated_at: str
+
+
+def read_run_manifest(path: str) -> RunManifest:
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_run_manifest(path: str, manifest: RunManifest):
+    manifest["updated_at"] = datetime.now().isoformat()
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+
+
+def upload_file(client: OpenAI, path: str) -> str:
+    with open(path, "rb") as file:
+        uploaded_file = client.files.create(file=file, purpose="fine-tune")
+
+    print(f"Uploaded {path}: {uploaded_file.id}")
+
+    return uploaded_file.id
+
+
+def wait_for_job(
+    client: OpenAI,
+    job_id: str,
+    poll_interval: float,
+    max_poll_interval: float,
+    on_update: Optional[Callable[[FineTuningJob], None]] = None,
+    max_retries: int = MAX_POLL_RETRIES,
+) -> FineTuningJob:
+    """Polls the job with exponential backoff until it has finished. A failed
+    poll is tried again up to `max_retries` times in a row, and the errors
+    which trying again does not fix are raised at once."""
+    interval = poll_interval
+    retries = 0
+
+    while True:
+        try:
+            job = client.fine_tuning.jobs.retrieve(job_id)
+        except Exception as e:
+            if isinstance(e, NON_RETRYABLE_ERRORS) or retries >= max_retries:
+                raise
+
+            print(e, f"Trying again in {interval} seconds")
+            retries += 1
+        else:
+            print(f"{datetime.now().isoformat()} {job.id}: {job.status}")
+            retries = 0
+
+            if on_update:
+                on_update(job)
+
+            if job.status in TERMINAL_STATUSES:
+                return job
+
+        sleep(interval)
+        interval = min(interval * 2, max_poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("api_key")
+    parser.add_argument("training_file")
+    parser.add_argument("validation_file")
+    parser.add_argument("run_manifest_file")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--suffix")
+    parser.add_argument("--epochs", type=int)
+    parser.add_argument("--base-url")
+    parser.add_argument("--poll-interval", type=float, default=10)
+    parser.add_argument("--max-poll-interval", type=float, default=300)
+    # Starts a new job even if the manifest has a succeeded one
+    parser.add_argument("--force", action="store_true")
+
+    args = parser.parse_args()
+    client = OpenAI(api_key=args.api_key, base_url=args.base_url)
+    manifest: Optional[RunManifest] = None
+
+    if os.path.isfile(args.run_manifest_file):
+        manifest = read_run_manifest(args.run_manifest_file)
+
+        if args.force:
+            manifest = None
+        elif manifest["status"] == "succeeded":
+            print(f"Fine-tuned model: {manifest['fine_tuned_model']}")
+            return
+        elif manifest["status"] in TERMINAL_STATUSES:
+            print(f"Job {manifest['job_id']} {manifest['status']}, starting again")
+            manifest = None
+        else:
+            print(f"Resuming job {manifest['job_id']}")
+
+    if not manifest:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            training_file_id, validation_file_id = executor.map(
+                lambda path: upload_file(client, path),
+                (args.training_file, args.validation_file),
+            )
+
+        job = client.fine_tuning.jobs.create(
+            model=args.model,
+            training_file=training_file_id,
+            validation_file=validation_file_id,
+            suffix=args.suffix or NOT_GIVEN,
+            hyperparameters={"n_epochs": args.epochs} if args.epochs else NOT_GIVEN,
+        )
+        manifest = {
+            "job_id": job.id,
+            "status": job.status,
+            "model": args.model,
+            "fine_tuned_model": job.fine_tuned_model,
+            "training_file": args.training_file,
+            "validation_file": args.validation_file,
+            "training_file_id": training_file_id,
+            "validation_file_id": validation_file_id,
+            "updated_at": "",
+        }
+        write_run_manifest(args.run_manifest_file, manifest)
+
+    def update_manifest(job: FineTuningJob):
+        manifest["status"] = job.status
+        manifest["fine_tuned_model"] = job.fine_tuned_model
+        write_run_manifest(args.run_manifest_file, manifest)
+
+    job = wait_for_job(
+        client,
+        manifest["job_id"],
+        args.poll_interval,
+        args.max_poll_interval,
+        update_manifest,
+    )
+
+    if job.status != "succeeded":
+        print(f"Fine-tuning {job.status}: {job.error}")
+        sys.exit(1)
+
+    print(f"Fine-tuned model: {job.fine_tuned_model}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Runs the data preparation and grading scripts as a pipeline of stages
+
+The stages and their dependencies are declared in a JSON file. A stage is
+skipped when its command and the fingerprints of its inputs are the same as
+after its previous successful run and its outputs exist. The fingerprints
+are based on the sizes and modification times of the files, or on their
+contents with --hash-contents. Stages whose dependencies have finished run in
+parallel, e.g. the per-course branches of the pipeline.
+
+Example pipeline file:
+{
+    "state_file": "pipeline_state.json",
+    "stages": [
+        {
+            "name": "anonymize",
+            "command": ["python", "anonymize_cpp_files.py", "C:/courses"],
+            "inputs": ["C:/courses/2023_autumn/student_repositories"]
+        },
+        {
+            "name": "training_data",
+            "command": ["python", "prepare_fine_tuning_training_data.py", "..."],
+            "inputs": ["C:/gradings", "C:/courses"],
+            "outputs": ["training.jsonl", "validation.jsonl", "metainfo.jsonl"],
+            "depends_on": ["anonymize"]
+        }
+    ]
+}
+
+The commands are run in the directory of this script unless a stage sets
+"cwd". Relative input and output paths are relative to the pipeline file.
+
+Usage:
+python run_pipeline.py <pipeline_file> [--jobs <n>] [--force <stage> ...] [--dry-run]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import NotRequired, Optional, TypedDict
+
+
+class Stage(TypedDict):
+    name: str
+    command: list[str]
+    inputs: NotRequired[list[str]]
+    outputs: NotRequired[list[str]]
+    depends_on: NotRequired[list[str]]
+    cwd: NotRequired[str]
+
+
+class Pipeline(TypedDict):
+    stages: list[Stage]
+    state_file: NotRequired[str]
+
+
+def get_path_fingerprint(path: str, hash_contents: bool) -> str:
+    fingerprint = hashlib.sha256()
+
+    def add_file(file_path: str):
+        fingerprint.update(os.path.relpath(file_path, path).encode())
+
+        if hash_contents:
+            with open(file_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    fingerprint.update(chunk)
+        else:
+            stat = os.stat(file_path)
+            fingerprint.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    if os.path.isfile(path):
+        add_file(path)
+    elif os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+
+            for file in sorted(files):
+                add_file(os.path.join(root, file))
+    else:
+        fingerprint.update(b"missing")
+
+    return fingerprint.hexdigest()
+
+
+def get_stage_fingerprint(stage: Stage, base_dir: str, hash_contents: bool) -> str:
+    fingerprint = hashlib.sha256(json.dumps(stage["command"]).encode())
+
+    for path in stage.get("inputs", []):
+        fingerprint.update(
+            get_path_fingerprint(os.path.join(base_dir, path), hash_contents).encode()
+        )
+
+    return fingerprint.hexdigest()
+
+
+def is_up_to_date(
+    stage: Stage, base_dir: str, state: dict[str, str], hash_contents: bool
+) -> bool:
+    return (
+        stage["name"] in state
+        and all(
+            os.path.exists(os.path.join(base_dir, path))
+            for path in stage.get("outputs", [])
+        )
+        and state[stage["name"]]
+        == get_stage_fingerprint(stage, base_dir, hash_contents)
+    )
+
+
+def get_cycle(stages: dict[str, Stage]) -> Optional[list[str]]:
+    """Returns the names of the stages forming a dependency cycle, starting and
+    ending with the same stage, or None if there is no cycle"""
+    visited: set[str] = set()
+    path: list[str] = []
+
+    def visit(name: str) -> Optional[list[str]]:
+        if name in path:
+            return path[path.index(name) :] + [name]
+
+        if name in visited:
+            return None
+
+        visited.add(name)
+        path.append(name)
+
+        for dependency in stages[name].get("depends_on", []):
+            cycle = visit(dependency)
+
+            if cycle:
+                return cycle
+
+        path.pop()
+
+        return None
+
+    for name in stages:
+        cycle = visit(name)
+
+        if cycle:
+            return cycle
+
+    return None
+
+
+def read_pipeline(pipeline_file: str) -> Pipeline:
+    """Reads the pipeline file and checks that the dependencies of the stages
+    exist and do not form a cycle"""
+    with open(pipeline_file, "r", encoding="utf-8") as file:
+        pipeline: Pipeline = json.load(file)
+
+    stages = {stage["name"]: stage for stage in pipeline["stages"]}
+
+    for stage in stages.values():
+        for dependency in stage.get("depends_on", []):
+            if dependency not in stages:
+                raise ValueError(f"Unknown dependency {dependency} of {stage['name']}")
+
+    cycle = get_cycle(stages)
+
+    if cycle:
+        raise ValueError(f"Dependency cycle: {' -> '.join(cycle)}")
+
+    return pipeline
+
+
+def run_stage(stage: Stage, scripts_dir: str) -> int:
+    print(f"[{stage['name']}] {' '.join(stage['command'])}")
+
+    return subprocess.run(
+        stage["command"], cwd=stage.get("cwd", scripts_dir)
+    ).returncode
+
+
+def get_dependents(stages: dict[str, Stage], name: str) -> set[str]:
+    dependents: set[str] = set()
+    pending = [name]
+
+    while pending:
+        current = pending.pop()
+
+        for stage in stages.values():
+            if (
+                current in stage.get("depends_on", [])
+                and stage["name"] not in dependents
+            ):
+                dependents.add(stage["name"])
+                pending.append(stage["name"])
+
+    return dependents
+
+
+def run_pipeline(
+    pipeline: Pipeline,
+    pipeline_file: str,
+    jobs: int,
+    forced: set[str],
+    hash_contents: bool,
+    dry_run: bool,
+) -> bool:
+    """Runs the stages in dependency order and returns whether all of them
+    succeeded"""
+    base_dir = os.path.dirname(os.path.abspath(pipeline_file))
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    state_file = os.path.join(
+        base_dir, pipeline.get("state_file", "pipeline_state.json")
+    )
+    stages = {stage["name"]: stage for stage in pipeline["stages"]}
+    state: dict[str, str] = {}
+
+    if os.path.isfile(state_file):
+        with open(state_file, "r", encoding="utf-8") as file:
+            state = json.load(file)
+
+    done: set[str] = set()
+    failed: set[str] = set()
+    # Stages which run again make their dependents run as well
+    invalidated: set[str] = set(forced)
+    running: dict[Future[int], Stage] = {}
+    # Taken before the stage runs, so that the inputs changing during the run
+    # make it run again next time
+    fingerprints: dict[str, str] = {}
+
+    def save_state():
+        with open(state_file, "w", encoding="utf-8") as file:
+            json.dump(state, file, indent=2)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(done) + len(failed) < len(stages):
+            running_names = {stage["name"] for stage in running.values()}
+
+            for name, stage in stages.items():
+                if (
+                    name in done
+                    or name in failed
+                    or name in running_names
+                    or not set(stage.get("depends_on", [])) <= done
+                ):
+                    continue
+
+                if name not in invalidated and is_up_to_date(
+                    stage, base_dir, state, hash_contents
+                ):
+                    print(f"[{name}] up to date")
+                    done.add(name)
+                    continue
+
+                invalidated |= get_dependents(stages, name)
+
+                if dry_run:
+                    print(f"[{name}] would run: {' '.join(stage['command'])}")
+                    done.add(name)
+                    continue
+
+                fingerprints[name] = get_stage_fingerprint(
+                    stage, base_dir, hash_contents
+                )
+                running[executor.submit(run_stage, stage, scripts_dir)] = stage
+
+            if not running:
+                if len(done) + len(failed) < len(stages):
+                    # The remaining stages depend on failed ones
+                    for name in stages.keys() - done - failed:
+                        print(f"[{name}] skipped due to failed dependencies")
+                        failed.add(name)
+
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                stage = running.pop(future)
+
+                if future.result() == 0:
+                    state[stage["name"]] = fingerprints[stage["name"]]
+                    done.add(stage["name"])
+                    save_state()
+                else:
+                    print(f"[{stage['name']}] failed with code {future.result()}")
+                    failed.add(stage["name"])
+                    state.pop(stage["name"], None)
+                    save_state()
+
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("pipeline_file")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--force", nargs="*", default=[])
+    parser.add_argument("--hash-contents", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+
+    args = parser.parse_args()
+
+    try:
+        pipeline = read_pipeline(args.pipeline_file)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not run_pipeline(
+        pipeline,
+        args.pipeline_file,
+        args.jobs,
+        set(args.force),
+        args.hash_contents,
+        args.dry_run,
+    ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
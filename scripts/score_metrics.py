@@ -0,0 +1,343 @@
+"""Computes agreement metrics between the AI points and the actual points of
+the grading runs saved by compare_feedbacks.py
+
+Assumes the following directory structure:
+<results_dir>/
+├── <run 1>/
+│   ├── overall_points_comparison.csv
+│   └── style_points_comparison.csv
+├── ...
+└── <run n>/
+    └── ...
+
+The submissions skipped in an iteration of the adaptive mode are left out of
+the metrics of that run and counted separately.
+
+Usage:
+python score_metrics.py <results_dir> [--bootstrap-samples <n>] [--output-file <file>]
+"""
+
+import argparse
+import csv
+import json
+import os
+import warnings
+import numpy as np
+
+from results_store import (
+    RESULTS_STORE_FILENAME,
+    SKIPPED_POINTS,
+    connect,
+    get_points_columns,
+)
+from typing import Optional, TypedDict
+
+POINTS_COMPARISON_FILES = {
+    "overall_points_comparison.csv": "overall_solution",
+    "style_points_comparison.csv": "style",
+}
+
+
+class ConfidenceInterval(TypedDict):
+    low: float
+    high: float
+
+
+class Metrics(TypedDict):
+    runs: int
+    submissions: int
+    skipped: list[int]
+    mae: list[float]
+    exact_agreement: list[float]
+    within_one_agreement: list[float]
+    cohen_kappa: list[float]
+    quadratic_weighted_kappa: list[float]
+    run_variance: list[float]
+    mean_submission_variance: float
+    confidence_intervals: dict[str, ConfidenceInterval]
+
+
+def to_array(points: tuple[str, ...]) -> np.ndarray:
+    """The points as floats, NaN for the missing, skipped and unparsable
+    ones"""
+
+    def to_float(point: str) -> float:
+        try:
+            return float(point)
+        except ValueError:
+            return np.nan
+
+    return np.array([to_float(point) for point in points])
+
+
+def is_skipped(points: tuple[str, ...]) -> np.ndarray:
+    return np.array([point == SKIPPED_POINTS for point in points], dtype=bool)
+
+
+def load_runs(
+    results_dir: str, results_filename: str
+) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the run names, the AI points as a (runs, submissions) array, the
+    actual points as a (submissions,) array and whether the AI points were
+    skipped as a (runs, submissions) array. Missing points are NaN. The
+    comparison files have no submission keys, so the runs are aligned by the
+    row order and must have the same number of submissions."""
+    runs: list[str] = []
+    ai_points: list[np.ndarray] = []
+    skipped: list[np.ndarray] = []
+    actual_points = np.empty(0)
+
+    for dir in sorted(os.listdir(results_dir)):
+        results_path = os.path.join(results_dir, dir, results_filename)
+
+        if not os.path.isfile(results_path):
+            continue
+
+        with open(results_path, "r", newline="") as file:
+            rows = [row + [""] * (2 - len(row)) for row in csv.reader(file) if row]
+
+        if not rows:
+            continue
+
+        if runs and len(rows) != actual_points.size:
+            raise ValueError(
+                f"{results_path} has {len(rows)} submissions but "
+                f"{os.path.join(results_dir, runs[0], results_filename)} has "
+                f"{actual_points.size}"
+            )
+
+        run_ai_points = tuple(row[0] for row in rows)
+        runs.append(dir)
+        ai_points.append(to_array(run_ai_points))
+        skipped.append(is_skipped(run_ai_points))
+
+        if not actual_points.size:
+            actual_points = to_array(tuple(row[1] for row in rows))
+
+    if not ai_points:
+        return runs, np.empty((0, 0)), actual_points, np.empty((0, 0), dtype=bool)
+
+    return runs, np.vstack(ai_points), actual_points, np.vstack(skipped)
+
+
+def load_runs_from_store(
+    results_dir: str, results_filename: str
+) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
+    runs, ai_points, actual_points = get_points_columns(
+        connect(os.path.join(results_dir, RESULTS_STORE_FILENAME)),
+        POINTS_COMPARISON_FILES[results_filename],
+    )
+
+    if not ai_points:
+        return (
+            runs,
+            np.empty((0, 0)),
+            to_array(actual_points),
+            np.empty((0, 0), dtype=bool),
+        )
+
+    return (
+        runs,
+        np.vstack([to_array(points) for points in ai_points]),
+        to_array(actual_points),
+        np.vstack([is_skipped(points) for points in ai_points]),
+    )
+
+
+def get_kappas(
+    ai_points: np.ndarray, actual_points: np.ndarray, valid: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Cohen's kappa and quadratic weighted kappa of each run"""
+    runs = ai_points.shape[0]
+    actual = np.broadcast_to(actual_points, ai_points.shape)
+
+    if not valid.any():
+        return np.full(runs, np.nan), np.full(runs, np.nan)
+
+    lowest = min(ai_points[valid].min(), actual[valid].min())
+    highest = max(ai_points[valid].max(), actual[valid].max())
+    categories = int(highest - lowest) + 1
+    run_indices = np.broadcast_to(np.arange(runs)[:, None], ai_points.shape)[valid]
+    ai = (ai_points[valid] - lowest).astype(np.int64)
+    actual_categories = (actual[valid] - lowest).astype(np.int64)
+    confusion = np.bincount(
+        (run_indices * categories + ai) * categories + actual_categories,
+        minlength=runs * categories * categories,
+    ).reshape(runs, categories, categories)
+    totals = confusion.sum(axis=(1, 2), keepdims=True)
+    observed = confusion / np.maximum(totals, 1)
+    expected = (
+        confusion.sum(axis=2)[:, :, None] * confusion.sum(axis=1)[:, None, :]
+    ) / np.maximum(totals, 1) ** 2
+    indices = np.arange(categories)
+    weights = {
+        "cohen": (indices[:, None] != indices[None, :]).astype(float),
+        "quadratic": (indices[:, None] - indices[None, :]) ** 2
+        / max(categories - 1, 1) ** 2,
+    }
+
+    def kappa(weight: np.ndarray) -> np.ndarray:
+        disagreement = np.einsum("ij,rij->r", weight, observed)
+        expected_disagreement = np.einsum("ij,rij->r", weight, expected)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(
+                expected_disagreement > 0,
+                1 - disagreement / expected_disagreement,
+                np.where(disagreement > 0, np.nan, 1.0),
+            )
+
+    return kappa(weights["cohen"]), kappa(weights["quadratic"])
+
+
+def get_bootstrap_confidence_intervals(
+    per_submission: dict[str, np.ndarray],
+    samples: int,
+    confidence: float,
+    seed: Optional[int],
+) -> dict[str, ConfidenceInterval]:
+    """Resamples the submissions and returns percentile confidence intervals
+    of the given per-submission statistics pooled over the runs"""
+    rng = np.random.default_rng(seed)
+    confidence_intervals: dict[str, ConfidenceInterval] = {}
+    alpha = (1 - confidence) / 2
+
+    for key, values in per_submission.items():
+        values = values[~np.isnan(values)]
+
+        if not values.size:
+            confidence_intervals[key] = {"low": np.nan, "high": np.nan}
+            continue
+
+        estimates = values[
+            rng.integers(0, values.size, size=(samples, values.size))
+        ].mean(axis=1)
+        low, high = np.quantile(estimates, (alpha, 1 - alpha))
+        confidence_intervals[key] = {"low": float(low), "high": float(high)}
+
+    return confidence_intervals
+
+
+def get_metrics(
+    ai_points: np.ndarray,
+    actual_points: np.ndarray,
+    skipped: Optional[np.ndarray] = None,
+    bootstrap_samples: int = 1000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+) -> Metrics:
+    valid = ~np.isnan(ai_points) & ~np.isnan(actual_points)[None, :]
+    difference = np.abs(ai_points - actual_points[None, :])
+    difference[~valid] = np.nan
+
+    with warnings.catch_warnings():
+        # All-NaN slices (submissions without points) are expected
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mae = np.nanmean(difference, axis=1)
+        exact = np.nanmean(np.where(valid, difference == 0, np.nan), axis=1)
+        within_one = np.nanmean(np.where(valid, difference <= 1, np.nan), axis=1)
+        run_variance = np.nanvar(ai_points, axis=1)
+        submission_variance = np.nanvar(ai_points, axis=0)
+        per_submission = {
+            "mae": np.nanmean(difference, axis=0),
+            "exact_agreement": np.nanmean(
+                np.where(valid, difference == 0, np.nan), axis=0
+            ),
+            "within_one_agreement": np.nanmean(
+                np.where(valid, difference <= 1, np.nan), axis=0
+            ),
+        }
+
+    cohen_kappa, quadratic_weighted_kappa = get_kappas(ai_points, actual_points, valid)
+
+    return {
+        "runs": ai_points.shape[0],
+        "submissions": ai_points.shape[1],
+        "skipped": (
+            skipped.sum(axis=1).tolist()
+            if skipped is not None
+            else [0] * ai_points.shape[0]
+        ),
+        "mae": mae.tolist(),
+        "exact_agreement": exact.tolist(),
+        "within_one_agreement": within_one.tolist(),
+        "cohen_kappa": cohen_kappa.tolist(),
+        "quadratic_weighted_kappa": quadratic_weighted_kappa.tolist(),
+        "run_variance": run_variance.tolist(),
+        "mean_submission_variance": (
+            float(np.nanmean(submission_variance))
+            if (~np.isnan(submission_variance)).any()
+            else np.nan
+        ),
+        "confidence_intervals": get_bootstrap_confidence_intervals(
+            per_submission, bootstrap_samples, confidence, seed
+        ),
+    }
+
+
+def print_metrics(results_filename: str, runs: list[str], metrics: Metrics):
+    print(
+        f"{results_filename}: {metrics['runs']} runs, "
+        f"{metrics['submissions']} submissions"
+    )
+    print("run\tMAE\texact\t±1\tkappa\tQWK\tvariance\tskipped")
+
+    for i, run in enumerate(runs):
+        print(
+            f"{run}\t{metrics['mae'][i]:.3f}\t{metrics['exact_agreement'][i]:.3f}\t"
+            f"{metrics['within_one_agreement'][i]:.3f}\t"
+            f"{metrics['cohen_kappa'][i]:.3f}\t"
+            f"{metrics['quadratic_weighted_kappa'][i]:.3f}\t"
+            f"{metrics['run_variance'][i]:.3f}\t"
+            f"{metrics['skipped'][i]}"
+        )
+
+    print(f"Mean variance between runs: {metrics['mean_submission_variance']:.3f}")
+
+    for key, interval in metrics["confidence_intervals"].items():
+        print(f"{key} CI: [{interval['low']:.3f}, {interval['high']:.3f}]")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("results_dir")
+    parser.add_argument("--bootstrap-samples", type=int, default=1000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output-file")
+    parser.add_argument("--results-store", choices=("files", "sqlite"), default="files")
+
+    args = parser.parse_args()
+    all_metrics: dict[str, Metrics] = {}
+
+    for results_filename in POINTS_COMPARISON_FILES:
+        try:
+            runs, ai_points, actual_points, skipped = (
+                load_runs_from_store if args.results_store == "sqlite" else load_runs
+            )(args.results_dir, results_filename)
+        except ValueError as e:
+            parser.error(str(e))
+
+        if not runs:
+            continue
+
+        metrics = get_metrics(
+            ai_points,
+            actual_points,
+            skipped,
+            bootstrap_samples=args.bootstrap_samples,
+            confidence=args.confidence,
+            seed=args.seed,
+        )
+        all_metrics[results_filename] = metrics
+
+        print_metrics(results_filename, runs, metrics)
+
+    if args.output_file:
+        with open(args.output_file, "w", encoding="utf-8") as file:
+            json.dump(all_metrics, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,22 @@
 from .types import Points
-from .utils import get_points_from_feedback
+from .feedback import (
+    FeedbackItem,
+    FeedbackParser,
+    FeedbackSection,
+    ItemKind,
+    StructuredFeedback,
+    parse_feedback,
+)
+from .utils import PointsScanner, get_points_from_feedback
 
-__all__ = ("Points", "get_points_from_feedback")
+__all__ = (
+    "FeedbackItem",
+    "FeedbackParser",
+    "FeedbackSection",
+    "ItemKind",
+    "Points",
+    "PointsScanner",
+    "StructuredFeedback",
+    "get_points_from_feedback",
+    "parse_feedback",
+)
@@ -0,0 +1,135 @@
+import re
+
+from dataclasses import dataclass, field
+from enum import StrEnum
+from typing import Any, Iterable
+from .types import Points
+from .utils import PointsScanner
+
+HEADING_PATTERN = re.compile(r"^([A-ZÄÖÅ][A-ZÄÖÅ0-9 ,&/()-]*[A-ZÄÖÅ)]):\s*(-?\d+)?")
+
+
+class ItemKind(StrEnum):
+    Positive = "+"
+    Negative = "-"
+    Remark = "*"
+
+
+@dataclass(slots=True)
+class FeedbackItem:
+    kind: ItemKind
+    text: str
+
+
+@dataclass(slots=True)
+class FeedbackSection:
+    heading: str
+    score: int | None = None
+    items: list[FeedbackItem] = field(default_factory=list)
+    notes: list[str] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class StructuredFeedback:
+    """Feedback parsed into its sections, the '+'/'-'/'*' items of each
+    section and the section scores"""
+
+    sections: list[FeedbackSection] = field(default_factory=list)
+    points: Points = field(
+        default_factory=lambda: {"overall_solution": "", "style": ""}
+    )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "sections": [
+                {
+                    "heading": section.heading,
+                    "score": section.score,
+                    "items": [[item.kind.value, item.text] for item in section.items],
+                    "notes": section.notes,
+                }
+                for section in self.sections
+            ],
+            "points": self.points,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "StructuredFeedback":
+        return cls(
+            sections=[
+                FeedbackSection(
+                    heading=section["heading"],
+                    score=section["score"],
+                    items=[
+                        FeedbackItem(ItemKind(kind), text)
+                        for kind, text in section["items"]
+                    ],
+                    notes=section["notes"],
+                )
+                for section in data["sections"]
+            ],
+            points=data["points"],
+        )
+
+
+class FeedbackParser:
+    """Builds a `StructuredFeedback` from the feedback lines fed one at a
+    time. Lines before the first section heading are kept as the notes of a
+    section without a heading."""
+
+    def __init__(self):
+        self.feedback = StructuredFeedback()
+        self.points_scanner = PointsScanner()
+
+    def get_section(self) -> FeedbackSection:
+        if not self.feedback.sections:
+            self.feedback.sections.append(FeedbackSection(heading=""))
+
+        return self.feedback.sections[-1]
+
+    def feed(self, line: str):
+        self.points_scanner.scan(line)
+        stripped = line.strip()
+
+        if not stripped:
+            return
+
+        # Model responses may format the headings with Markdown
+        heading_match = HEADING_PATTERN.match(
+            stripped.lstrip("#").strip().removeprefix("**").removesuffix("**")
+        )
+
+        if heading_match:
+            score = heading_match.group(2)
+            self.feedback.sections.append(
+                FeedbackSection(
+                    heading=heading_match.group(1),
+                    score=int(score) if score else None,
+                )
+            )
+            return
+
+        section = self.get_section()
+        kind = stripped[:1]
+
+        if kind in ("+", "-", "*"):
+            section.items.append(FeedbackItem(ItemKind(kind), stripped[1:].strip()))
+        elif line[:1].isspace() and section.items:
+            # Continuation of a multi-line item
+            section.items[-1].text += f" {stripped}"
+        else:
+            section.notes.append(stripped)
+
+    def get_feedback(self) -> StructuredFeedback:
+        self.feedback.points = self.points_scanner.get_points()
+
+        return self.feedback
+
+
+def parse_feedback(feedback: str | Iterable[str]) -> StructuredFeedback:
+    parser = FeedbackParser()
+
+    for line in (feedback.splitlines() if isinstance(feedback, str) else feedback):
+        parser.feed(line)
+
+    return parser.get_feedback()
@@ -3,21 +3,50 @@ import re
 from .types import Points
 from .constants import OverallSolution
 
+SCORE_HEADINGS: dict[str, tuple[str, ...]] = {
+    "overall_solution": (OverallSolution.FI, OverallSolution.EN),
+    "style": ("OHJELMOINTITYYLI", "PROGRAMMING STYLE"),
+}
+SCORE_PATTERNS: dict[str, tuple[re.Pattern[str], ...]] = {
+    key: tuple(re.compile(rf"{score_heading}: (-?\d+)") for score_heading in headings)
+    for key, headings in SCORE_HEADINGS.items()
+}
 
-def get_points(score_headings: tuple[str, ...], feedback: str) -> str:
-    for score_heading in score_headings:
-        match = re.search(rf"{score_heading}: (-?\d+)", feedback)
 
-        if match:
-            return match.group(1)
+class PointsScanner:
+    """Finds the points line by line with the same precedence as
+    `get_points_from_feedback` applied to the whole text"""
 
-    return ""
+    def __init__(self):
+        self.matches: dict[str, list[str]] = {
+            key: [""] * len(patterns) for key, patterns in SCORE_PATTERNS.items()
+        }
+
+    def scan(self, line: str):
+        for key, patterns in SCORE_PATTERNS.items():
+            for i, pattern in enumerate(patterns):
+                if self.matches[key][i]:
+                    continue
+
+                match = pattern.search(line)
+
+                if match:
+                    self.matches[key][i] = match.group(1)
+
+    def get_points(self) -> Points:
+        points = {
+            key: next((match for match in matches if match), "")
+            for key, matches in self.matches.items()
+        }
+
+        return {
+            "overall_solution": points["overall_solution"],
+            "style": points["style"],
+        }
 
 
 def get_points_from_feedback(feedback: str) -> Points:
-    return {
-        "overall_solution": get_points(
-            (OverallSolution.FI, OverallSolution.EN), feedback
-        ),
-        "style": get_points(("OHJELMOINTITYYLI", "PROGRAMMING STYLE"), feedback),
-    }
+    scanner = PointsScanner()
+    scanner.scan(feedback)
+
+    return scanner.get_points()
@@ -0,0 +1,122 @@
+import xml.etree.ElementTree as ElementTree
+
+from dataclasses import dataclass, field
+from typing import IO
+
+NODE_TAGS = ("widget", "layout", "spacer", "action")
+# The properties telling what the user sees or can do with the widget
+KEY_PROPERTIES = (
+    "text",
+    "title",
+    "windowTitle",
+    "placeholderText",
+    "toolTip",
+    "geometry",
+    "orientation",
+    "minimum",
+    "maximum",
+    "value",
+    "checkable",
+    "checked",
+    "readOnly",
+    "enabled",
+    "currentIndex",
+)
+
+
+@dataclass(slots=True)
+class UiNode:
+    depth: int
+    name: str
+    class_name: str
+    properties: list[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        line = f"{'  ' * self.depth}{self.name or '-'} ({self.class_name})"
+
+        if self.properties:
+            line += f" [{'; '.join(self.properties)}]"
+
+        return line
+
+
+def get_property_value(property_element: ElementTree.Element) -> str:
+    value_element = next(iter(property_element), None)
+
+    if value_element is None:
+        return ""
+
+    if value_element.tag in ("rect", "size", "point"):
+        values = {child.tag: child.text or "" for child in value_element}
+        position = (
+            f"{values['x']},{values['y']} " if "x" in values and "y" in values else ""
+        )
+        size = (
+            f"{values['width']}x{values['height']}"
+            if "width" in values and "height" in values
+            else ""
+        )
+
+        return (position + size).strip()
+
+    if value_element.tag in ("string", "cstring"):
+        return f'"{value_element.text or ""}"'
+
+    # Enums and sets are written with their scope, e.g. Qt::Horizontal
+    return (value_element.text or "").rsplit("::", 1)[-1]
+
+
+def summarize_ui(source: str | IO[bytes]) -> str:
+    """Turns a Qt Designer .ui file into a compact tree of its widgets,
+    layouts and actions with their key properties, followed by the
+    signal-slot connections. The XML is parsed as a stream and each element is
+    released once it has been summarized."""
+    nodes: list[UiNode] = []
+    open_nodes: list[UiNode] = []
+    connections: list[str] = []
+    parents: list[str] = []
+
+    for event, element in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if element.tag in NODE_TAGS:
+                node = UiNode(
+                    depth=len(open_nodes),
+                    name=element.get("name", ""),
+                    class_name=element.get("class", element.tag),
+                )
+                nodes.append(node)
+                open_nodes.append(node)
+
+            parents.append(element.tag)
+            continue
+
+        parents.pop()
+
+        if element.tag in NODE_TAGS:
+            open_nodes.pop()
+            element.clear()
+        elif element.tag == "property":
+            name = element.get("name", "")
+
+            if open_nodes and parents[-1] in NODE_TAGS and name in KEY_PROPERTIES:
+                value = get_property_value(element)
+
+                if value:
+                    open_nodes[-1].properties.append(f"{name}={value}")
+
+            element.clear()
+        elif element.tag == "connection":
+            values = {child.tag: child.text or "" for child in element}
+            connections.append(
+                f"{values.get('sender')}.{values.get('signal')} -> "
+                f"{values.get('receiver')}.{values.get('slot')}"
+            )
+            element.clear()
+
+    lines = [str(node) for node in nodes]
+
+    if connections:
+        lines.append("connections:")
+        lines.extend(f"  {connection}" for connection in connections)
+
+    return "\n".join(lines) + "\n"
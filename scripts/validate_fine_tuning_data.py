@@ -0,0 +1,262 @@
+"""Validates the fine-tuning data files and reports statistics before they
+are uploaded
+
+The files are streamed line by line, so the memory use does not depend on
+their size. With the metainfo file written by
+prepare_fine_tuning_training_data.py, the entries are also counted per
+course and project.
+
+Usage:
+python validate_fine_tuning_data.py <data_file> [<data_file> ...] [--metainfo-file <file>]
+
+Example:
+python validate_fine_tuning_data.py training.jsonl validation.jsonl --metainfo-file metainfo.jsonl --price-per-million-tokens 3
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from collections import Counter
+from typing import Any, Iterator, Optional, TypedDict
+from prompt_data import (
+    ENCODING,
+    MetainfoEntry,
+    count_tokens,
+    resolve_metainfo_file_path,
+)
+from prompt_data.openai import Role
+
+# Tokens added by the chat format for each message and for the reply priming
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+DEFAULT_CONTEXT_LIMIT = 65536
+DEFAULT_BUCKET_SIZE = 1000
+
+
+class FileStatistics(TypedDict):
+    entries: int
+    errors: int
+    total_tokens: int
+    max_tokens: int
+    over_context_limit: int
+    histogram: Counter[int]
+    distribution: Counter[str]
+
+
+def get_schema_errors(data: Any) -> list[str]:
+    """Checks the entry against the `prompt_data.openai.Message` format: a
+    system message, one or more user messages and the assistant message"""
+    if not isinstance(data, dict) or set(data) != {"messages"}:
+        return ["The entry must be an object with only a 'messages' key"]
+
+    messages = data["messages"]
+
+    if not isinstance(messages, list) or not messages:
+        return ["'messages' must be a non-empty list"]
+
+    errors: list[str] = []
+    roles: list[str] = []
+
+    for i, message in enumerate(messages):
+        if not isinstance(message, dict) or set(message) != {"role", "content"}:
+            errors.append(f"Message {i} must have only 'role' and 'content' keys")
+            continue
+
+        if message["role"] not in tuple(Role):
+            errors.append(f"Message {i} has an unknown role: {message['role']}")
+
+        if not isinstance(message["content"], str) or not message["content"].strip():
+            errors.append(f"Message {i} has no content")
+
+        roles.append(message["role"])
+
+    if roles and roles[-1] != Role.Assistant:
+        errors.append("The last message must be from the assistant")
+
+    if Role.User not in roles:
+        errors.append("There must be at least one user message")
+
+    if Role.System in roles[1:]:
+        errors.append("Only the first message can be a system message")
+
+    return errors
+
+
+def get_entry_tokens(data: dict[str, Any]) -> int:
+    return TOKENS_PER_REPLY + sum(
+        TOKENS_PER_MESSAGE + count_tokens(message["content"])
+        for message in data["messages"]
+    )
+
+
+def read_metainfo(metainfo_path: str, data_path: str) -> Iterator[MetainfoEntry]:
+    """Yields the metainfo entries of the data file in the order they were
+    written, i.e. in the order of the lines of the data file"""
+    path = os.path.abspath(data_path)
+
+    with open(metainfo_path, "r", encoding=ENCODING) as file:
+        for line in file:
+            entry: MetainfoEntry = json.loads(line)
+
+            if resolve_metainfo_file_path(entry["file"], metainfo_path) == path:
+                yield entry
+
+
+def validate_file(
+    path: str,
+    metainfo_path: Optional[str],
+    context_limit: int,
+    bucket_size: int,
+    max_errors_shown: int,
+) -> FileStatistics:
+    statistics: FileStatistics = {
+        "entries": 0,
+        "errors": 0,
+        "total_tokens": 0,
+        "max_tokens": 0,
+        "over_context_limit": 0,
+        "histogram": Counter(),
+        "distribution": Counter(),
+    }
+    metainfo = read_metainfo(metainfo_path, path) if metainfo_path else None
+    metainfo_entry: Optional[MetainfoEntry] = next(metainfo, None) if metainfo else None
+    offset = 0
+
+    reported = 0
+
+    def report(line_number: int, problem: str):
+        nonlocal reported
+        reported += 1
+
+        if reported <= max_errors_shown:
+            print(f"{path}:{line_number}: {problem}")
+
+    with open(path, "rb") as file:
+        for line_number, line in enumerate(file, start=1):
+            line_offset = offset
+            offset += len(line)
+            statistics["entries"] += 1
+
+            while (
+                metainfo and metainfo_entry and metainfo_entry["offset"] < line_offset
+            ):
+                metainfo_entry = next(metainfo, None)
+
+            if metainfo_entry and metainfo_entry["offset"] == line_offset:
+                statistics["distribution"][
+                    f"{metainfo_entry['language']}/{metainfo_entry['course']}/"
+                    f"{metainfo_entry['project']}"
+                ] += 1
+
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                statistics["errors"] += 1
+                report(line_number, f"Invalid JSON: {e}")
+                continue
+
+            errors = get_schema_errors(data)
+
+            for error in errors:
+                report(line_number, error)
+
+            if errors:
+                statistics["errors"] += 1
+                continue
+
+            tokens = get_entry_tokens(data)
+            statistics["total_tokens"] += tokens
+            statistics["max_tokens"] = max(statistics["max_tokens"], tokens)
+            statistics["histogram"][tokens // bucket_size] += 1
+
+            if tokens > context_limit:
+                statistics["over_context_limit"] += 1
+                report(
+                    line_number,
+                    f"{tokens} tokens exceed the context limit of {context_limit}",
+                )
+
+    return statistics
+
+
+def print_statistics(
+    path: str,
+    statistics: FileStatistics,
+    bucket_size: int,
+    epochs: int,
+    price_per_million_tokens: Optional[float],
+):
+    entries = statistics["entries"]
+    print(
+        f"{path}: {entries} entries, {statistics['errors']} invalid, "
+        f"{statistics['over_context_limit']} over the context limit",
+        f"Tokens: {statistics['total_tokens']} total, "
+        f"{statistics['total_tokens'] // max(entries, 1)} mean, "
+        f"{statistics['max_tokens']} max",
+        sep=os.linesep,
+    )
+
+    if price_per_million_tokens is not None:
+        cost = statistics["total_tokens"] * price_per_million_tokens / 1_000_000
+        print(f"Estimated cost: {cost:.2f} per epoch, {cost * epochs:.2f} in total")
+
+    print("Token length histogram:")
+    largest_bucket = max(statistics["histogram"].values(), default=1)
+
+    for bucket in sorted(statistics["histogram"]):
+        count = statistics["histogram"][bucket]
+        print(
+            f"{bucket * bucket_size:>7}-{(bucket + 1) * bucket_size - 1:<7} "
+            f"{count:>6} {'#' * max(1, 50 * count // largest_bucket)}"
+        )
+
+    if statistics["distribution"]:
+        print("Entries per language/course/project:")
+
+        for key, count in sorted(statistics["distribution"].items()):
+            print(f"{key}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("data_files", nargs="+")
+    parser.add_argument("--metainfo-file")
+    parser.add_argument("--context-limit", type=int, default=DEFAULT_CONTEXT_LIMIT)
+    parser.add_argument("--bucket-size", type=int, default=DEFAULT_BUCKET_SIZE)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--price-per-million-tokens", type=float)
+    parser.add_argument("--max-errors-shown", type=int, default=20)
+
+    args = parser.parse_args()
+    has_problems = False
+
+    for path in args.data_files:
+        statistics = validate_file(
+            path,
+            args.metainfo_file,
+            args.context_limit,
+            args.bucket_size,
+            args.max_errors_shown,
+        )
+        has_problems = (
+            has_problems
+            or statistics["errors"] > 0
+            or statistics["over_context_limit"] > 0
+        )
+
+        print_statistics(
+            path,
+            statistics,
+            args.bucket_size,
+            args.epochs,
+            args.price_per_million_tokens,
+        )
+
+    sys.exit(1 if has_problems else 0)
+
+
+if __name__ == "__main__":
+    main()
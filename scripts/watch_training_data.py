@@ -0,0 +1,326 @@
+"""Watches the feedback and source files and appends the prompts of new and
+changed submissions to the fine-tuning data
+
+The tree is polled at an interval. A submission is rebuilt when its
+palaute.txt or any file in its src directory has been added or changed since
+the previous poll, which is tracked in a state file. The code files of the
+rebuilt submissions are anonymized again and their entries are appended to
+the training or validation file and to the metainfo file. A submission keeps
+the partition recorded for it in the metainfo file, and a new submission is
+assigned to a partition based on the hash of its path.
+
+When a changed submission has been appended, the files are compacted after
+the poll: the superseded entries are removed from the data files and the
+metainfo file, so that fine-tuning never sees two versions of the same
+submission. Changes to the feedback templates and grading instructions are not
+watched.
+
+Usage:
+python watch_training_data.py <courses_source_dir> <courses_destination_dir> <training_data_output_file> <validation_data_output_file> <metainfo_output_file> [--interval <seconds>] [--once] [--initialize]
+
+Example:
+python watch_training_data.py C:/courses C:/courses_code training.jsonl validation.jsonl metainfo.jsonl --normalize --summarize-ui
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+from time import sleep
+from typing import Optional, TextIO
+from anonymize_cpp_files import anonymize_student
+from cpp_normalizer import DEFAULT_INDENT_WIDTH, NormalizationOptions
+from prompt_data import (
+    ENCODING,
+    Partition,
+    PartitionWriter,
+    dumps,
+    resolve_metainfo_file_path,
+    write_entry,
+)
+from prompt_data.constants import Language
+from prompt_data.data_gathering import get_course_dirs, get_entry, get_submissions
+from prompt_data.types import MetainfoEntry, Submission
+
+WatchState = dict[str, str]
+
+
+def get_submission_key(submission: Submission) -> str:
+    return "/".join(
+        (
+            submission["course"],
+            submission["project"],
+            submission["course_assistant"],
+            submission["student_id"],
+        )
+    )
+
+
+def get_fingerprint(submission: Submission) -> str:
+    """Hash of the sizes and modification times of the feedback and the
+    source files of the submission"""
+    fingerprint = hashlib.sha256()
+    src_path = os.path.join(submission["destination_student_path"], "src")
+    paths = [submission["feedback_path"]] + (
+        [os.path.join(src_path, file) for file in sorted(os.listdir(src_path))]
+        if os.path.isdir(src_path)
+        else []
+    )
+
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            fingerprint.update(f"{path}:missing".encode())
+        else:
+            fingerprint.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    return fingerprint.hexdigest()
+
+
+def read_partitions(metainfo_path: str) -> dict[str, Partition]:
+    """The partitions of the submissions by their source_code_path, from the
+    entries appended last"""
+    partitions: dict[str, Partition] = {}
+
+    if not os.path.isfile(metainfo_path):
+        return partitions
+
+    with open(metainfo_path, "r", encoding=ENCODING) as file:
+        for line in file:
+            entry: MetainfoEntry = json.loads(line)
+            partitions[entry["source_code_path"]] = Partition(entry["partition"])
+
+    return partitions
+
+
+def get_partition(source_code_path: str, training_data_percentage: float) -> Partition:
+    position = int(hashlib.sha256(source_code_path.encode()).hexdigest()[:8], 16)
+
+    return (
+        Partition.Training
+        if position / 0x100000000 < training_data_percentage
+        else Partition.Validation
+    )
+
+
+def compact_files(metainfo_path: str) -> int:
+    """Removes the superseded entries, i.e. all but the entry appended last for
+    each source_code_path, from the data files and the metainfo file. The
+    files are written next to the originals and replace them when complete.
+    Returns the count of removed entries."""
+    with open(metainfo_path, "r", encoding=ENCODING) as file:
+        entries: list[MetainfoEntry] = [json.loads(line) for line in file]
+
+    current = {entry["source_code_path"]: index for index, entry in enumerate(entries)}
+    kept = [
+        entry
+        for index, entry in enumerate(entries)
+        if current[entry["source_code_path"]] == index
+    ]
+
+    if len(kept) == len(entries):
+        return 0
+
+    compacted_paths = {
+        resolve_metainfo_file_path(entry["file"], metainfo_path)
+        for index, entry in enumerate(entries)
+        if current[entry["source_code_path"]] != index
+    }
+
+    for path in compacted_paths:
+        path_entries = sorted(
+            (
+                entry
+                for entry in kept
+                if resolve_metainfo_file_path(entry["file"], metainfo_path) == path
+            ),
+            key=lambda entry: entry["offset"],
+        )
+
+        with open(path, "rb") as source, open(f"{path}.tmp", "wb") as destination:
+            for entry in path_entries:
+                source.seek(entry["offset"])
+                line = source.read(entry["length"])
+                entry["offset"] = destination.tell()
+                destination.write(line)
+
+    with open(f"{metainfo_path}.tmp", "w", encoding=ENCODING) as file:
+        for entry in kept:
+            file.write(dumps(entry) + "\n")
+
+    for path in compacted_paths:
+        os.replace(f"{path}.tmp", path)
+
+    os.replace(f"{metainfo_path}.tmp", metainfo_path)
+
+    return len(entries) - len(kept)
+
+
+def read_state(path: str) -> WatchState:
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path, "r", encoding=ENCODING) as file:
+        return json.load(file)
+
+
+def write_state(path: str, state: WatchState):
+    # Replaced atomically so that an interrupted write does not lose the state
+    with open(f"{path}.tmp", "w", encoding=ENCODING) as file:
+        json.dump(state, file)
+
+    os.replace(f"{path}.tmp", path)
+
+
+def poll(
+    args: argparse.Namespace,
+    state: WatchState,
+    options: Optional[NormalizationOptions],
+    partitions: dict[str, Partition],
+) -> tuple[int, int]:
+    """Rebuilds the new and changed submissions and returns their count and the
+    count of the entries they supersede"""
+    writers: dict[Partition, PartitionWriter] = {}
+    metainfo_file: Optional[TextIO] = None
+    rebuilt = superseded = 0
+
+    try:
+        for submission in get_submissions(
+            args.courses_source_dir,
+            args.courses_destination_dir,
+            get_course_dirs(args.courses_source_dir, args.course),
+        ):
+            key = get_submission_key(submission)
+            fingerprint = get_fingerprint(submission)
+
+            if state.get(key) == fingerprint:
+                continue
+
+            if args.initialize:
+                state[key] = fingerprint
+                continue
+
+            try:
+                anonymize_student(
+                    submission["destination_student_path"],
+                    options,
+                    args.summarize_ui,
+                )
+                result = get_entry(submission, args.target_language)
+            except Exception as e:
+                # E.g. a feedback file still being written, tried again later
+                print(f"Skipping {key}: {e}")
+                continue
+
+            state[key] = fingerprint
+
+            if not result:
+                continue
+
+            language, entry = result
+
+            if entry["source_code_path"] in partitions:
+                superseded += 1
+
+            partition = partitions.get(entry["source_code_path"]) or get_partition(
+                entry["source_code_path"], args.training_data_percentage
+            )
+            partitions[entry["source_code_path"]] = partition
+
+            if not writers:
+                writers = {
+                    Partition.Training: PartitionWriter(
+                        args.training_data_output_file, append=True
+                    ),
+                    Partition.Validation: PartitionWriter(
+                        args.validation_data_output_file, append=True
+                    ),
+                }
+                metainfo_file = open(args.metainfo_output_file, "a", encoding=ENCODING)
+
+            write_entry(
+                entry,
+                language,
+                submission["course"],
+                submission["project"],
+                partition,
+                writers[partition],
+                metainfo_file,  # type: ignore
+            )
+            rebuilt += 1
+            print(f"Rebuilt {key} ({partition})")
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+        if metainfo_file:
+            metainfo_file.close()
+
+    return rebuilt, superseded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("courses_source_dir")
+    parser.add_argument("courses_destination_dir")
+    parser.add_argument("training_data_output_file")
+    parser.add_argument("validation_data_output_file")
+    parser.add_argument("metainfo_output_file")
+    parser.add_argument("--course")
+    parser.add_argument("--target-language", type=Language)
+    parser.add_argument("--training-data-percentage", type=float, default=0.8)
+    parser.add_argument("--state-file")
+    parser.add_argument("--interval", type=float, default=10)
+    parser.add_argument("--once", action="store_true")
+    # Records the current files as seen, e.g. after a full run of
+    # prepare_fine_tuning_training_data.py
+    parser.add_argument("--initialize", action="store_true")
+    parser.add_argument("--normalize", action="store_true")
+    parser.add_argument("--indent-width", type=int, default=DEFAULT_INDENT_WIDTH)
+    parser.add_argument("--drop-includes", action="store_true")
+    parser.add_argument("--drop-generated", action="store_true")
+    parser.add_argument("--summarize-ui", action="store_true")
+
+    args = parser.parse_args()
+
+    if (args.drop_includes or args.drop_generated) and not args.normalize:
+        parser.error("--drop-includes and --drop-generated require --normalize")
+
+    state_file = args.state_file or f"{args.metainfo_output_file}.watch.json"
+    state = read_state(state_file)
+    partitions = read_partitions(args.metainfo_output_file)
+    options = (
+        NormalizationOptions(
+            indent_width=args.indent_width,
+            drop_includes=args.drop_includes,
+            drop_generated=args.drop_generated,
+        )
+        if args.normalize
+        else None
+    )
+
+    while True:
+        rebuilt, superseded = poll(args, state, options, partitions)
+        write_state(state_file, state)
+
+        if args.initialize:
+            print(f"Recorded {len(state)} submissions")
+            break
+
+        if rebuilt:
+            print(f"Appended {rebuilt} entries")
+
+        if superseded:
+            print(f"Removed {compact_files(args.metainfo_output_file)} old entries")
+
+        if args.once:
+            break
+
+        sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()